@@ -19,7 +19,7 @@ import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.feature_extraction.text import CountVectorizer
 
-from KaggleWord2VecUtility import KaggleWord2VecUtility
+from ReviewCache import ReviewCache
 
 if __name__ == '__main__':
     train = pd.read_csv(os.path.join(os.path.dirname(__file__), 'data', 'labeledTrainData.tsv'), header=0,
@@ -35,16 +35,15 @@ if __name__ == '__main__':
     print 'Download text data sets. If you already have NLTK datasets downloaded, just close the Python download window...'
     # nltk.download()  # Download text data sets, including stop words
 
-    # Initialize an empty list to hold the clean reviews
-    clean_train_reviews = []
-
-    # Loop over each review; create an index i that goes from 0 to the length
-    # of the movie review list
+    # Clean and parse every review, joining the words of each review back
+    # into one string. The tokenized reviews are cached in data/cache, so
+    # only the first run cleans them (in chunks across a pool of processes)
+    cache = ReviewCache()
 
     print "Cleaning and parsing the training set movie reviews...\n"
-    for i in xrange(0, len(train["review"])):
-        clean_train_reviews.append(
-            " ".join(KaggleWord2VecUtility.review_to_wordlist(train["review"][i], True)))
+    clean_train_reviews = [" ".join(words) for words in
+                           cache.load(os.path.join(os.path.dirname(__file__), 'data', 'labeledTrainData.tsv'),
+                                      remove_stopwords=True)]
 
     # ****** Create a bag of words from the training set
     #
@@ -81,13 +80,11 @@ if __name__ == '__main__':
     # This may take a few minutes to run
     forest = forest.fit(train_data_features, train["sentiment"])
 
-    # Create an empty list and append the clean reviews one by one
-    clean_test_reviews = []
-
+    # Clean the test reviews the same way
     print "Cleaning and parsing the test set movie reviews...\n"
-    for i in xrange(0, len(test["review"])):
-        clean_test_reviews.append(
-            " ".join(KaggleWord2VecUtility.review_to_wordlist(test["review"][i], True)))
+    clean_test_reviews = [" ".join(words) for words in
+                          cache.load(os.path.join(os.path.dirname(__file__), 'data', 'testData.tsv'),
+                                     remove_stopwords=True)]
 
     # Get a bag of words for the test set, and convert to a numpy array
     test_data_features = vectorizer.transform(clean_test_reviews)
@@ -2,14 +2,44 @@
 
 import re
 import nltk
+import itertools
+import multiprocessing
 
 import pandas as pd
 import numpy as np
+import scipy.sparse
 
 from bs4 import BeautifulSoup
 from nltk.corpus import stopwords
 
 
+# HTML tags and character entities, removed by the lightweight cleaner
+# instead of parsing every review into a BeautifulSoup tree
+html_tag_re = re.compile(r"</?[a-zA-Z!][^>]*>|&#?\w+;")
+non_letters_re = re.compile("[^a-zA-Z]")
+
+# English stop words, loaded once per process
+_stops = None
+
+def english_stopwords():
+    global _stops
+    if _stops is None:
+        _stops = set(stopwords.words("english"))
+    return _stops
+
+
+def clean_chunk( args ):
+    # Cleans a chunk of reviews in a worker process. 'args' is a tuple of the
+    # reviews, remove_stopwords and a sentence tokenizer (None for word lists).
+    # Words are joined by spaces, into one string per review (or sentence),
+    # which is much cheaper to send back than lists of words
+    reviews, remove_stopwords, tokenizer = args
+    if tokenizer is None:
+        return [" ".join(KaggleWord2VecUtility.strip_review_to_wordlist( review, remove_stopwords )) for review in reviews]
+    return [[" ".join(sentence) for sentence in \
+        KaggleWord2VecUtility.strip_review_to_sentences( review, tokenizer, remove_stopwords )] for review in reviews]
+
+
 class KaggleWord2VecUtility(object):
     """KaggleWord2VecUtility is a utility class for processing raw HTML text into segments for further learning"""
 
@@ -29,7 +59,7 @@ class KaggleWord2VecUtility(object):
         #
         # 4. Optionally remove stop words (false by default)
         if remove_stopwords:
-            stops = set(stopwords.words("english"))
+            stops = english_stopwords()
             words = [w for w in words if not w in stops]
         #
         # 5. Return a list of words
@@ -56,3 +86,68 @@ class KaggleWord2VecUtility(object):
         # Return the list of sentences (each sentence is a list of words,
         # so this returns a list of lists
         return sentences
+
+    @staticmethod
+    def strip_review_to_wordlist( review, remove_stopwords=False ):
+        # Same as review_to_wordlist, but HTML tags and entities are stripped
+        # with a regular expression instead of parsing the review
+        review_text = html_tag_re.sub(" ", review)
+        words = non_letters_re.sub(" ", review_text).lower().split()
+        if remove_stopwords:
+            stops = english_stopwords()
+            words = [w for w in words if not w in stops]
+        return words
+
+    @staticmethod
+    def strip_review_to_sentences( review, tokenizer, remove_stopwords=False ):
+        # Same as review_to_sentences, with the lightweight HTML stripping
+        raw_sentences = tokenizer.tokenize(review.decode('utf8').strip())
+        return [KaggleWord2VecUtility.strip_review_to_wordlist( raw_sentence, remove_stopwords ) \
+            for raw_sentence in raw_sentences if len(raw_sentence) > 0]
+
+    @staticmethod
+    def clean_reviews( reviews, remove_stopwords=False, tokenizer=None, processes=None, chunksize=500 ):
+        # Generator over the cleaned 'reviews', in input order: the list of words
+        # of each review, or its list of sentences if a sentence 'tokenizer' is
+        # given. Reviews are cleaned in chunks of 'chunksize' across a pool of
+        # 'processes' (default the number of cores; 1 cleans in this process).
+        #
+        # Usage: clean_train_reviews = list(KaggleWord2VecUtility.clean_reviews( train["review"], True ))
+        reviews = iter(reviews)
+        chunks = iter(lambda: list(itertools.islice(reviews, chunksize)), [])
+        tasks = ((chunk, remove_stopwords, tokenizer) for chunk in chunks)
+        if processes == 1:
+            cleaned_chunks = itertools.imap(clean_chunk, tasks)
+        else:
+            pool = multiprocessing.Pool(processes)
+            cleaned_chunks = pool.imap(clean_chunk, tasks)
+
+        try:
+            for cleaned_chunk in cleaned_chunks:
+                for cleaned in cleaned_chunk:
+                    if tokenizer is None:
+                        yield cleaned.split()
+                    else:
+                        yield [sentence.split() for sentence in cleaned]
+        finally:
+            if processes != 1:
+                pool.terminate()
+                pool.join()
+
+    @staticmethod
+    def reviews_to_matrix( reviews, word_index ):
+        # Sparse (reviews, len(word_index)) matrix of how often each word of
+        # 'word_index' (a dict word -> column) occurs in each review. 'reviews'
+        # are lists of words, or the TokenizedReviews of a ReviewCache. Words
+        # missing from 'word_index' are skipped
+        if hasattr(reviews, 'term_matrix'):
+            return reviews.term_matrix(word_index)
+        indices = []
+        indptr = [0]
+        for review in reviews:
+            indices.extend([word_index[w] for w in review if w in word_index])
+            indptr.append(len(indices))
+        matrix = scipy.sparse.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr),
+                                         shape=(len(indptr) - 1, len(word_index)))
+        matrix.sum_duplicates()
+        return matrix
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+#  This file caches the cleaned and tokenized reviews of the Kaggle
+#  tutorial data files, so that repeated experiments skip the HTML
+#  stripping, cleaning and sentence tokenization.
+#
+# *************************************** #
+
+import os
+import array
+import hashlib
+
+import nltk.data
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from KaggleWord2VecUtility import KaggleWord2VecUtility
+
+
+# Bump to invalidate the caches when the cleaning in KaggleWord2VecUtility changes
+CACHE_VERSION = 1
+
+
+class TokenizedReviews(object):
+    """TokenizedReviews holds the tokens of every review of a file as integer ids into a vocabulary"""
+
+    def __init__( self, vocabulary, ids, sentence_starts, review_starts, sentences ):
+        self.vocabulary = vocabulary            # Id -> word
+        self.ids = ids                          # Ids of all tokens, review after review
+        self.sentence_starts = sentence_starts  # Offset of each sentence into 'ids', plus the end
+        self.review_starts = review_starts      # Offset of each review into the sentences, plus the end
+        self.has_sentences = sentences          # Whether reviews are lists of sentences or of words
+
+    def __len__( self ):
+        return len(self.review_starts) - 1
+
+    def __iter__( self ):
+        # Iterates over the reviews, as lists of words or lists of sentences
+        for i in xrange(len(self)):
+            yield self.review(i)
+
+    def review( self, i ):
+        sentences = [self.words(j) for j in xrange(self.review_starts[i], self.review_starts[i + 1])]
+        if self.has_sentences:
+            return sentences
+        return sentences[0]
+
+    def words( self, j ):
+        # Returns the words of the j-th sentence (of the j-th review without sentences)
+        vocabulary = self.vocabulary
+        return [vocabulary[k] for k in self.ids[self.sentence_starts[j]:self.sentence_starts[j + 1]].tolist()]
+
+    def sentences( self ):
+        # Iterates over the sentences of all reviews, as lists of words
+        for j in xrange(len(self.sentence_starts) - 1):
+            yield self.words(j)
+
+    def term_matrix( self, word_index ):
+        # Sparse (reviews, len(word_index)) matrix of how often each word of
+        # 'word_index' (a dict word -> column) occurs in each review, computed
+        # from the token ids without building the word lists
+        columns = np.array([word_index.get(word, -1) for word in self.vocabulary], dtype=np.int64)[self.ids]
+        token_starts = self.sentence_starts[self.review_starts]
+        rows = np.repeat(np.arange(len(self)), np.diff(token_starts))
+        known = columns >= 0
+        return scipy.sparse.csr_matrix((np.ones(known.sum(), dtype=np.float32), (rows[known], columns[known])),
+                                       shape=(len(self), len(word_index)))
+
+
+class ReviewCache(object):
+    """ReviewCache keeps the tokenized reviews of TSV data files on disk, keyed by the
+    hash of the file and the cleaning options"""
+
+    def __init__( self, directory=None ):
+        self.directory = directory if directory is not None else \
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cache')
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    @staticmethod
+    def file_hash( path ):
+        # SHA-1 of the contents of the file at 'path', read in blocks
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), ''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def cache_path( self, path, remove_stopwords=False, sentences=False ):
+        # Cache file of the reviews of 'path' cleaned with the given options.
+        # Sentences are assumed to be split by the same (punkt) tokenizer
+        options = "v%d-%s-%s" % (CACHE_VERSION, "nostop" if remove_stopwords else "all",
+                                 "sentences" if sentences else "words")
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.directory, "%s-%s-%s.npz" % (name, self.file_hash(path), options))
+
+    def load( self, path, remove_stopwords=False, sentences=False, tokenizer=None, processes=None ):
+        # Returns the TokenizedReviews of the TSV file at 'path', from the cache if
+        # it holds them, otherwise cleaning the reviews and adding them to the cache.
+        # With 'sentences' the reviews are split into sentences by 'tokenizer'
+        # (default the NLTK punkt tokenizer), see KaggleWord2VecUtility.clean_reviews
+        cache_path = self.cache_path(path, remove_stopwords, sentences)
+        if os.path.exists(cache_path):
+            archive = np.load(cache_path)
+            return TokenizedReviews(str(archive['vocabulary']).split("\n"), archive['ids'],
+                                    archive['sentence_starts'], archive['review_starts'], sentences)
+
+        reviews = pd.read_csv(path, header=0, delimiter="\t", quoting=3)["review"]
+        if sentences and tokenizer is None:
+            tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
+
+        # Intern the words, in the order they are first seen
+        word_ids = {}
+        ids = array.array('i')
+        sentence_starts = array.array('i', [0])
+        review_starts = array.array('i', [0])
+        for review in KaggleWord2VecUtility.clean_reviews(reviews, remove_stopwords, tokenizer if sentences else None, processes):
+            for sentence in (review if sentences else [review]):
+                for word in sentence:
+                    word_id = word_ids.get(word)
+                    if word_id is None:
+                        word_id = word_ids[word] = len(word_ids)
+                    ids.append(word_id)
+                sentence_starts.append(len(ids))
+            review_starts.append(len(sentence_starts) - 1)
+
+        vocabulary = [None] * len(word_ids)
+        for word, word_id in word_ids.iteritems():
+            vocabulary[word_id] = str(word)
+
+        tokenized = TokenizedReviews(vocabulary, np.frombuffer(ids, dtype=np.int32),
+                                     np.frombuffer(sentence_starts, dtype=np.int32),
+                                     np.frombuffer(review_starts, dtype=np.int32), sentences)
+
+        # Write to a temporary file first, so an interrupted run leaves no partial cache
+        temporary = cache_path + ".tmp"
+        with open(temporary, 'wb') as f:
+            np.savez(f, vocabulary="\n".join(vocabulary), ids=tokenized.ids,
+                     sentence_starts=tokenized.sentence_starts, review_starts=tokenized.review_starts)
+        os.rename(temporary, cache_path)
+        return tokenized
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+#  This file streams the parsed sentences of the Kaggle tutorial data
+#  files to Word2Vec, instead of holding all of them in one list.
+#
+# *************************************** #
+
+import nltk.data
+import pandas as pd
+
+from KaggleWord2VecUtility import KaggleWord2VecUtility
+
+
+class SentenceCorpus(object):
+    """SentenceCorpus iterates over the sentences of the reviews of TSV data files, lazily
+    and as many times as needed, so Word2Vec can make its passes with bounded memory"""
+
+    def __init__( self, paths, cache=None, tokenizer=None, remove_stopwords=False, chunksize=10000, processes=None ):
+        # 'paths' are the TSV files whose reviews are split into sentences. With a
+        # ReviewCache as 'cache', the sentences of each file are read from the cache,
+        # one file at a time; otherwise the files are read and cleaned in chunks of
+        # 'chunksize' reviews on every pass
+        self.paths = list(paths)
+        self.cache = cache
+        self.tokenizer = tokenizer if tokenizer is not None else nltk.data.load('tokenizers/punkt/english.pickle')
+        self.remove_stopwords = remove_stopwords
+        self.chunksize = chunksize
+        self.processes = processes
+
+    def __iter__( self ):
+        # Starts a new pass over the sentences, as lists of words
+        for path in self.paths:
+            if self.cache is not None:
+                reviews = self.cache.load(path, remove_stopwords=self.remove_stopwords, sentences=True,
+                                          tokenizer=self.tokenizer, processes=self.processes)
+                for sentence in reviews.sentences():
+                    yield sentence
+                continue
+
+            for chunk in pd.read_csv(path, header=0, delimiter="\t", quoting=3, chunksize=self.chunksize):
+                for review_sentences in KaggleWord2VecUtility.clean_reviews(chunk["review"], self.remove_stopwords,
+                                                                            self.tokenizer, self.processes):
+                    for sentence in review_sentences:
+                        yield sentence
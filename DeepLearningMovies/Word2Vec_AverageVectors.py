@@ -23,6 +23,8 @@ from gensim.models import Word2Vec
 from sklearn.ensemble import RandomForestClassifier
 
 from KaggleWord2VecUtility import KaggleWord2VecUtility
+from ReviewCache import ReviewCache
+from SentenceCorpus import SentenceCorpus
 
 
 # ****** Define functions to create average word vectors
@@ -53,37 +55,40 @@ def makeFeatureVec(words, model, num_features):
     return featureVec
 
 
-def getAvgFeatureVecs(reviews, model, num_features):
-    # Given a set of reviews (each one a list of words), calculate
-    # the average feature vector for each one and return a 2D numpy array
+def getAvgFeatureVecs(reviews, model, num_features, chunksize=10000):
+    # Given a set of reviews (each one a list of words, or the TokenizedReviews
+    # of a ReviewCache), calculate the average feature vector for each one and
+    # return a 2D numpy array
     #
-    # Initialize a counter
-    counter = 0.
+    # Map every word of the model's vocabulary to its row of word vectors, once
+    word_index = dict((word, i) for i, word in enumerate(model.index2word))
+    #
+    # Count the vocabulary words of every review in a sparse document-term
+    # matrix, then sum the word vectors of each review with a matrix product
+    counts = KaggleWord2VecUtility.reviews_to_matrix(reviews, word_index)
+    nwords = np.asarray(counts.sum(axis=1), dtype="float32")
     #
     # Preallocate a 2D numpy array, for speed
-    reviewFeatureVecs = np.zeros((len(reviews),num_features),dtype="float32")
+    reviewFeatureVecs = np.zeros((counts.shape[0],num_features),dtype="float32")
     #
-    # Loop through the reviews
-    for review in reviews:
-       #
-       # Print a status message every 1000th review
-       if counter%1000. == 0.:
-           print "Review %d of %d" % (counter, len(reviews))
+    # Multiply in chunks of reviews, to bound the memory of the dense products
+    for start in xrange(0, counts.shape[0], chunksize):
        #
-       # Call the function (defined above) that makes average feature vectors
-       reviewFeatureVecs[counter] = makeFeatureVec(review, model, \
-           num_features)
+       # Print a status message every chunk
+       print "Review %d of %d" % (start, counts.shape[0])
        #
-       # Increment the counter
-       counter = counter + 1.
+       # Divide the sums by the number of words to get the averages. Reviews
+       # without any vocabulary word keep a vector of zeros
+       end = min(start + chunksize, counts.shape[0])
+       reviewFeatureVecs[start:end] = counts[start:end].dot(model.syn0) / \
+           np.maximum(nwords[start:end], 1.)
     return reviewFeatureVecs
 
 
 def getCleanReviews(reviews):
-    clean_reviews = []
-    for review in reviews["review"]:
-        clean_reviews.append( KaggleWord2VecUtility.review_to_wordlist( review, remove_stopwords=True ))
-    return clean_reviews
+    # Cleans the reviews in chunks across a pool of processes, see
+    # KaggleWord2VecUtility.clean_reviews
+    return list( KaggleWord2VecUtility.clean_reviews( reviews["review"], remove_stopwords=True ))
 
 
 
@@ -108,15 +113,15 @@ if __name__ == '__main__':
 
     # ****** Split the labeled and unlabeled training sets into clean sentences
     #
-    sentences = []  # Initialize an empty list of sentences
-
-    print "Parsing sentences from training set"
-    for review in train["review"]:
-        sentences += KaggleWord2VecUtility.review_to_sentences(review, tokenizer)
+    # The sentences are streamed to Word2Vec on each of its passes rather than
+    # held in one list. They are read from the cache in data/cache kept by
+    # ReviewCache, so only the first run has to clean and tokenize the reviews
+    cache = ReviewCache()
 
-    print "Parsing sentences from unlabeled set"
-    for review in unlabeled_train["review"]:
-        sentences += KaggleWord2VecUtility.review_to_sentences(review, tokenizer)
+    print "Parsing sentences from training and unlabeled sets"
+    sentences = SentenceCorpus([os.path.join(os.path.dirname(__file__), 'data', 'labeledTrainData.tsv'),
+                                os.path.join(os.path.dirname(__file__), 'data', 'unlabeledTrainData.tsv')],
+                               cache=cache, tokenizer=tokenizer)
 
     # ****** Set parameters and train the word2vec model
     #
@@ -160,11 +165,15 @@ if __name__ == '__main__':
     #
     print "Creating average feature vecs for training reviews"
 
-    trainDataVecs = getAvgFeatureVecs( getCleanReviews(train), model, num_features )
+    clean_train_reviews = cache.load( os.path.join(os.path.dirname(__file__), 'data', 'labeledTrainData.tsv'), \
+        remove_stopwords=True )
+    trainDataVecs = getAvgFeatureVecs( clean_train_reviews, model, num_features )
 
     print "Creating average feature vecs for test reviews"
 
-    testDataVecs = getAvgFeatureVecs( getCleanReviews(test), model, num_features )
+    clean_test_reviews = cache.load( os.path.join(os.path.dirname(__file__), 'data', 'testData.tsv'), \
+        remove_stopwords=True )
+    testDataVecs = getAvgFeatureVecs( clean_test_reviews, model, num_features )
 
 
     # ****** Fit a random forest to the training set, then make predictions
@@ -22,17 +22,21 @@ from bs4 import BeautifulSoup
 import re
 from nltk.corpus import stopwords
 import numpy as np
+import scipy.sparse
 import os
+from collections import defaultdict
 from KaggleWord2VecUtility import KaggleWord2VecUtility
+from ReviewCache import ReviewCache
 
 
 # Define a function to create bags of centroids
 #
-def create_bag_of_centroids( wordlist, word_centroid_map ):
+def create_bag_of_centroids( wordlist, word_centroid_map, num_centroids=None ):
     #
     # The number of clusters is equal to the highest cluster index
-    # in the word / centroid map
-    num_centroids = max( word_centroid_map.values() ) + 1
+    # in the word / centroid map, unless given
+    if num_centroids is None:
+        num_centroids = max( word_centroid_map.values() ) + 1
     #
     # Pre-allocate the bag of centroids vector (for speed)
     bag_of_centroids = np.zeros( num_centroids, dtype="float32" )
@@ -49,6 +53,45 @@ def create_bag_of_centroids( wordlist, word_centroid_map ):
     return bag_of_centroids
 
 
+# Define a function to create the bags of centroids of all reviews at once
+#
+def create_bags_of_centroids( reviews, word_centroid_map, num_centroids=None ):
+    #
+    # Number the words of the word / centroid map once, and look up the
+    # cluster of each word number in an array
+    words = word_centroid_map.keys()
+    word_index = dict( zip( words, xrange( len(words) ) ) )
+    centroids = np.array( [word_centroid_map[word] for word in words], dtype=int )
+    if num_centroids is None:
+        num_centroids = centroids.max() + 1 if len(centroids) > 0 else 0
+    #
+    # Count the words of every review in a sparse (reviews, words) matrix.
+    # 'reviews' are lists of words, or the TokenizedReviews of a ReviewCache
+    counts = KaggleWord2VecUtility.reviews_to_matrix( reviews, word_index )
+    #
+    # Multiplying by the sparse (words, centroids) assignment matrix adds up
+    # the counts of the words of each cluster
+    assignment = scipy.sparse.csr_matrix( (np.ones( len(words), dtype="float32" ), \
+        (np.arange( len(words) ), centroids)), shape=(len(words), num_centroids) )
+    #
+    # Return the "bags of centroids" as a sparse (reviews, centroids) matrix
+    return counts.dot( assignment ).tocsr()
+
+
+# Define a function to list the words of every cluster
+#
+def create_cluster_index( word_centroid_map, num_centroids=None ):
+    #
+    # Invert the word / centroid map in a single pass over the vocabulary:
+    # returns a list holding the words of each cluster
+    clusters = defaultdict( list )
+    for word, centroid in word_centroid_map.iteritems():
+        clusters[centroid].append( word )
+    if num_centroids is None:
+        num_centroids = max( clusters ) + 1 if clusters else 0
+    return [clusters[centroid] for centroid in xrange( num_centroids )]
+
+
 if __name__ == '__main__':
 
     model = Word2Vec.load("300features_40minwords_10context")
@@ -79,18 +122,17 @@ if __name__ == '__main__':
     # a cluster number
     word_centroid_map = dict(zip( model.index2word, idx ))
 
+    # List the words of each cluster once
+    cluster_words = create_cluster_index( word_centroid_map, num_clusters )
+
     # Print the first ten clusters
     for cluster in xrange(0,10):
         #
         # Print the cluster number
         print "\nCluster %d" % cluster
         #
-        # Find all of the words for that cluster number, and print them out
-        words = []
-        for i in xrange(0,len(word_centroid_map.values())):
-            if( word_centroid_map.values()[i] == cluster ):
-                words.append(word_centroid_map.keys()[i])
-        print words
+        # Print all of the words for that cluster number
+        print cluster_words[cluster]
 
 
 
@@ -103,41 +145,28 @@ if __name__ == '__main__':
     test = pd.read_csv(os.path.join(os.path.dirname(__file__), 'data', 'testData.tsv'), header=0, delimiter="\t", quoting=3 )
 
 
+    # The tokenized reviews are cached in data/cache by ReviewCache
+    cache = ReviewCache()
+
     print "Cleaning training reviews"
-    clean_train_reviews = []
-    for review in train["review"]:
-        clean_train_reviews.append( KaggleWord2VecUtility.review_to_wordlist( review, \
-            remove_stopwords=True ))
+    clean_train_reviews = cache.load( os.path.join(os.path.dirname(__file__), 'data', 'labeledTrainData.tsv'), \
+        remove_stopwords=True )
 
     print "Cleaning test reviews"
-    clean_test_reviews = []
-    for review in test["review"]:
-        clean_test_reviews.append( KaggleWord2VecUtility.review_to_wordlist( review, \
-            remove_stopwords=True ))
+    clean_test_reviews = cache.load( os.path.join(os.path.dirname(__file__), 'data', 'testData.tsv'), \
+        remove_stopwords=True )
 
 
     # ****** Create bags of centroids
     #
-    # Pre-allocate an array for the training set bags of centroids (for speed)
-    train_centroids = np.zeros( (train["review"].size, num_clusters), \
-        dtype="float32" )
-
-    # Transform the training set reviews into bags of centroids
-    counter = 0
-    for review in clean_train_reviews:
-        train_centroids[counter] = create_bag_of_centroids( review, \
-            word_centroid_map )
-        counter += 1
+    # Transform the training set reviews into a sparse matrix of bags of
+    # centroids, one row per review
+    train_centroids = create_bags_of_centroids( clean_train_reviews, \
+        word_centroid_map, num_clusters )
 
     # Repeat for test reviews
-    test_centroids = np.zeros(( test["review"].size, num_clusters), \
-        dtype="float32" )
-
-    counter = 0
-    for review in clean_test_reviews:
-        test_centroids[counter] = create_bag_of_centroids( review, \
-            word_centroid_map )
-        counter += 1
+    test_centroids = create_bags_of_centroids( clean_test_reviews, \
+        word_centroid_map, num_clusters )
 
 
     # ****** Fit a random forest and extract predictions
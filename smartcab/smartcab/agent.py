@@ -3,24 +3,30 @@ import math
 from environment import Agent, Environment
 from planner import RoutePlanner
 from simulator import Simulator
+from qtable import QTable, QBatch
 
 class LearningAgent(Agent):
     """ An agent that learns to drive in the Smartcab world.
         This is the object you will be modifying. """
 
-    def __init__(self, env, learning=False, epsilon=1.0, alpha=0.5, seed=42, decay_function=0, epsilon_step=0.05, use_input_right=True):
+    def __init__(self, env, learning=False, epsilon=1.0, alpha=0.5, seed=None, decay_function=0, epsilon_step=0.05, use_input_right=True, compact_q=False, waypoint_table=False, q_table=None, q_batch=None, state_encoder=None):
         super(LearningAgent, self).__init__(env)     # Set the agent in the evironment
-        self.planner = RoutePlanner(self.env, self)  # Create a route planner
+        self.planner = RoutePlanner(self.env, self, use_table=waypoint_table)  # Create a route planner
         self.valid_actions = self.env.valid_actions  # The set of valid actions
 
         # Set parameters of the learning agent
         self.learning = learning # Whether the agent is expected to learn
-        self.Q = dict()          # Create a Q-table which will be a dictionary of tuples
+        if seed is not None:     # Own random stream, instead of the one derived from the environment's seed
+            self.random = random.Random(seed)
+        self.Q = QTable(self.valid_actions, rng=self.random) if compact_q else dict() # Create a Q-table, keyed by state tuples
+        if q_table is not None:  # Share the Q-table of other learners
+            self.Q = q_table
+        self.q_batch = q_batch   # Collects the Q-updates of learners sharing 'q_table', if set
+        self.state_encoder = state_encoder  # Maps the inputs to integer state ids instead of tuples, see encoders.py
         self.epsilon = epsilon   # Random exploration factor
         self.alpha = alpha       # Learning factor
 
         # Set any additional class parameters as needed
-        random.seed(seed)
         self.t = 0
         self.decay_function = decay_function
         self.epsilon_step = epsilon_step
@@ -93,6 +99,9 @@ class LearningAgent(Agent):
         # constraints in order for you to learn how to adjust epsilon and alpha, and thus learn about the balance between exploration and exploitation.
         # With the hand-engineered features, this learning process gets entirely negated.
 
+        if self.state_encoder is not None:
+            return self.state_encoder.encode(self, inputs, waypoint, deadline)
+
         # Set 'state' as a tuple of relevant data for the agent
         state = (inputs['light'], waypoint, inputs['left'], inputs['oncoming'],)
 
@@ -108,10 +117,15 @@ class LearningAgent(Agent):
 
         # Calculate the maximum Q-value of all actions for a given state
 
-        # getting max actions (https://stackoverflow.com/questions/268272/getting-key-with-maximum-value-in-dictionary):
-        max_actions = list(filter(lambda t: t[1] == max(self.Q[state].values()), self.Q[state].items()))
-        maxQ = random.choice(max_actions)[0]
-        print('maxQ_action taken: %s from %s' % (maxQ, max_actions))
+        if isinstance(self.Q, QTable):
+            maxQ = self.Q.argmax(state) # Ties are broken randomly
+        else:
+            # getting max actions (https://stackoverflow.com/questions/268272/getting-key-with-maximum-value-in-dictionary):
+            max_value = max(self.Q[state].values())
+            max_actions = [action for action, value in self.Q[state].items() if value == max_value]
+            maxQ = self.random.choice(max_actions)
+        if not self.env.quiet:
+            print('maxQ_action taken: %s' % (maxQ,))
         return maxQ
 
 
@@ -141,10 +155,10 @@ class LearningAgent(Agent):
         # Otherwise, choose an action with the highest Q-value for the current state
         # Be sure that when choosing an action with highest Q-value that you randomly select between actions that "tie".
         if not self.learning:
-            action = random.choice(self.valid_actions)
+            action = self.random.choice(self.valid_actions)
         else:
-            if random.uniform(0.0, 1.0) <= self.epsilon:
-                action = random.choice(self.valid_actions)
+            if self.random.uniform(0.0, 1.0) <= self.epsilon:
+                action = self.random.choice(self.valid_actions)
             else:
                 action = self.get_maxQ(self.state)
         return action
@@ -158,9 +172,13 @@ class LearningAgent(Agent):
         if self.learning:
             # When learning, implement the value iteration update rule
             #   Use only the learning rate 'alpha' (do not use the discount factor 'gamma')
+            if self.q_batch is not None: # Applied together with the other learners' updates at the end of the step
+                self.q_batch.add(state, action, reward, self.alpha)
+                return
             before = self.Q[state][action]
             self.Q[state][action] = before * ( 1.0 - self.alpha ) + reward * self.alpha
-            print ('learn before: %s, and after: %s' % (before, self.Q[state][action]))
+            if not self.env.quiet:
+                print ('learn before: %s, and after: %s' % (before, self.Q[state][action]))
 
         return
 
@@ -179,6 +197,25 @@ class LearningAgent(Agent):
         return
 
 
+def create_learners(env, n, shared=False, batch_updates=False, **kwargs):
+    """ Creates 'n' LearningAgents (with the arguments 'kwargs') that learn at the same
+        time in 'env', each on its own route. Set one as the primary agent to follow.
+
+        'shared' lets all learners use one Q-table, 'batch_updates' makes learners
+        sharing a table apply their Q-updates of a step together at its end. """
+
+    if shared:
+        kwargs['q_table'] = QTable(env.valid_actions, rng=env.random_stream('q_table')) if kwargs.get('compact_q') else dict()
+        if batch_updates:
+            kwargs['q_batch'] = QBatch(kwargs['q_table'])
+            env.step_hooks.append(kwargs['q_batch'].apply)
+
+    learners = [env.create_agent(LearningAgent, **kwargs) for i in xrange(n)]
+    for learner in learners:
+        env.add_learner(learner)
+    return learners
+
+
 def run():
     """ Driving function for running the simulation.
         Press ESC to close the simulation, or [SPACE] to pause the simulation. """
@@ -200,7 +237,8 @@ def run():
     #   verbose     - set to True to display additional output from the simulation
     #   num_dummies - discrete number of dummy agents in the environment, default is 100
     #   grid_size   - discrete number of intersections (columns, rows), default is (8, 6)
-    env = Environment()
+    #   seed        - master seed of the random streams of the simulation, default is None (unseeded)
+    env = Environment(seed=42)
 
     ##############
     # Create the driving agent
@@ -208,6 +246,9 @@ def run():
     #   learning   - set to True to force the driving agent to use Q-learning
     #    * epsilon - continuous value for the exploration factor, default is 1
     #    * alpha   - continuous value for the learning rate, default is 0.5
+    #    * compact_q - set to True to store the Q-table in a contiguous array (QTable)
+    #    * waypoint_table - set to True to look waypoints up in a table precomputed for the grid
+    #    * state_encoder  - an encoder of encoders.py to map the inputs to integer state ids, e.g. DeadlineEncoder()
     agent = env.create_agent(LearningAgent, learning=True, epsilon=epsilon, alpha=alpha, decay_function=decay_function, epsilon_step=epsilon_step, use_input_right=use_input_right)
 
     ##############
@@ -221,8 +262,20 @@ def run():
     # Flags:
     #   update_delay - continuous time (in seconds) between actions, default is 2.0 seconds
     #   display      - set to False to disable the GUI if PyGame is enabled
+    #   incremental_render - set to False to redraw the whole GUI every frame instead of only what changed
     #   log_metrics  - set to True to log trial and simulation results to /logs
     #   optimized    - set to True to change the default log file name
+    #   log_format   - set to 'csv' or 'npz' to log typed metric columns instead of stringified dicts
+    #   headless     - set to True to step trials back-to-back without GUI or per-step output
+    #   trace_dir    - directory to record every step of the primary agent to, for replay with steptrace.py
+    #   profile      - set to True to report the time spent per phase of the simulation at the end of the run
+    #   profile_file - JSON file to also export that breakdown to
+    #   capture_dir  - directory to save the frames of the captured trials to, rendered offscreen
+    #   capture_trials - function of (trial, testing) selecting the trials to capture, default all testing trials
+    #   capture_format - 'png' for one image per frame or 'gif' for one animation per trial (needs Pillow)
+    #   checkpoint_file - file to save the Q-table, epsilon, alpha and trial counters of the agent to
+    #   checkpoint_interval - number of training trials between checkpoints, default is 10
+    #   warm_start   - checkpoint file to resume the agent and the trial counters from
     sim = Simulator(env, update_delay=0.0, log_metrics=True, optimized=True, display=False)
 
     ##############
@@ -230,6 +283,7 @@ def run():
     # Flags:
     #   tolerance  - epsilon tolerance before beginning testing, default is 0.05
     #   n_test     - discrete number of testing trials to perform, default is 0
+    #   testing_only - set to True to skip training, e.g. when warm-started from a checkpoint
     sim.run(n_test=10, tolerance=tolerance)
 
 
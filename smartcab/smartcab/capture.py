@@ -0,0 +1,64 @@
+import os
+import importlib
+
+
+def testing_trials(trial, testing):
+    """ Default selection of the trials to capture: every testing trial. """
+
+    return testing
+
+
+class FrameCapture(object):
+    """ Saves the frames rendered by the Simulator for a selection of trials.
+
+        'trials' is a function of (trial, testing) that returns True for the
+        trials to capture. With 'format' 'png' every frame is saved as an image
+        <directory>/<training|testing>-<trial>/frame-<step>.png, with 'gif' each
+        trial becomes one animated <directory>/<training|testing>-<trial>.gif,
+        which requires PIL (Pillow). """
+
+    def __init__(self, directory, pygame, trials=None, format='png', frame_duration=200):
+        assert format in ('png', 'gif'), "Unknown capture format!"
+        self.directory = directory
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.pygame = pygame
+        self.trials = trials if trials is not None else testing_trials
+        self.format = format
+        self.frame_duration = frame_duration  # Milliseconds per frame of an animation
+        if self.format == 'gif':
+            self.Image = importlib.import_module('PIL.Image')
+
+        self.name = None    # Name of the trial being captured
+        self.frames = []    # Frames of the trial being captured ('gif' only)
+        self.count = 0      # Number of frames of the trial being captured
+
+    def wants(self, trial, testing):
+        return self.trials(trial, testing)
+
+    def begin(self, trial, testing):
+        """ Starts the capture of a trial. """
+
+        self.name = "{}-{:04d}".format('testing' if testing else 'training', trial)
+        self.frames = []
+        self.count = 0
+        if self.format == 'png' and not os.path.isdir(os.path.join(self.directory, self.name)):
+            os.makedirs(os.path.join(self.directory, self.name))
+
+    def add(self, surface):
+        """ Captures the rendered 'surface' as the next frame. """
+
+        if self.format == 'png':
+            self.pygame.image.save(surface, os.path.join(self.directory, self.name, "frame-{:04d}.png".format(self.count)))
+        else:
+            self.frames.append(self.Image.frombytes('RGB', surface.get_size(), self.pygame.image.tostring(surface, 'RGB')))
+        self.count += 1
+
+    def end(self):
+        """ Finishes the capture of a trial, writing the animation if needed. """
+
+        if self.format == 'gif' and self.frames:
+            self.frames[0].save(os.path.join(self.directory, "{}.gif".format(self.name)), save_all=True,
+                                append_images=self.frames[1:], duration=self.frame_duration, loop=0)
+        self.frames = []
+        self.name = None
@@ -0,0 +1,76 @@
+import os
+import ast
+import numpy as np
+from collections import OrderedDict
+
+from qtable import QTable
+
+
+def save_checkpoint(filename, agent, trial, total_trials, testing=False):
+    """ Writes the learning state of 'agent' to a compressed NumPy archive: its
+        Q-table as a (states, actions) array, epsilon, alpha and the parameters of
+        their decay, its random stream and the trial counters to resume from.
+
+        States are stored as their repr, so tuples of the default state and the
+        integer ids of a state encoder both round-trip. The archive is written to
+        a temporary file first, so an interrupted save keeps the previous one. """
+
+    actions = list(agent.valid_actions)
+    if isinstance(agent.Q, QTable):
+        states = list(agent.Q.states)
+        values = agent.Q.values[:len(states), [agent.Q.action_ids[action] for action in actions]]
+    else:
+        states = list(agent.Q)
+        values = np.array([[agent.Q[state][action] for action in actions] for state in states], dtype=float).reshape(len(states), len(actions))
+
+    temporary = "{}.tmp".format(filename)
+    with open(temporary, 'wb') as f:
+        np.savez_compressed(f,
+            states=np.array([repr(state) for state in states]),
+            actions=np.array([repr(action) for action in actions]),
+            values=values,
+            epsilon=agent.epsilon,
+            alpha=agent.alpha,
+            t=agent.t,
+            decay_function=agent.decay_function,
+            epsilon_step=agent.epsilon_step,
+            random_state=repr(agent.random.getstate()),
+            trial=trial,
+            total_trials=total_trials,
+            testing=testing)
+    os.rename(temporary, filename)
+
+
+def load_checkpoint(filename, agent):
+    """ Restores the learning state of 'agent' from a checkpoint written by
+        save_checkpoint. The Q-table of the agent is refilled in place, so it stays
+        shared with other learners and keeps its kind (dict or QTable). Returns
+        the trial counters as a dict of 'trial', 'total_trials' and 'testing'. """
+
+    Q = load_q_table(filename)
+    agent.Q.clear()
+    for state, action_values in Q.iteritems():
+        agent.Q[state] = action_values
+
+    archive = np.load(filename)
+    agent.epsilon = float(archive['epsilon'])
+    agent.alpha = float(archive['alpha'])
+    agent.t = float(archive['t'])
+    agent.decay_function = int(archive['decay_function'])
+    agent.epsilon_step = float(archive['epsilon_step'])
+    agent.random.setstate(ast.literal_eval(str(archive['random_state'])))
+
+    return {
+        'trial': int(archive['trial']),
+        'total_trials': int(archive['total_trials']),
+        'testing': bool(archive['testing'])
+    }
+
+
+def load_q_table(filename):
+    """ Returns the Q-table of a checkpoint as {action: value} dicts by state, in the saved order. """
+
+    archive = np.load(filename)
+    states = [ast.literal_eval(state) for state in archive['states']]
+    actions = [ast.literal_eval(action) for action in archive['actions']]
+    return OrderedDict((state, dict(zip(actions, row.tolist()))) for state, row in zip(states, archive['values']))
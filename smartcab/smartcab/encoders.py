@@ -0,0 +1,128 @@
+import bisect
+import numpy as np
+
+from environment import Environment
+
+
+class StateEncoder(object):
+    """ Maps the inputs of a LearningAgent directly to an integer state id.
+
+        An encoder is given its 'features' as (name, possible values) pairs and
+        computes the value of each feature in 'values'. The id is the mixed-radix
+        number of the value positions, so ids range over 0 .. size - 1 and a Q-table
+        can be sized before the run. Every encoded state is counted in 'visits'. """
+
+    def __init__(self, features):
+        self.features = features
+        self.names = [name for name, values in self.features]
+        self.positions = [dict((value, i) for i, value in enumerate(values)) for name, values in self.features]
+        self.strides = []
+        size = 1
+        for name, values in reversed(self.features):
+            self.strides.insert(0, size)
+            size *= len(values)
+        self.size = size
+        self.visits = np.zeros(self.size, dtype=int)
+
+    def values(self, agent, inputs, waypoint, deadline):
+        """ Returns the value of each feature for the current step of 'agent'. """
+
+        raise NotImplementedError
+
+    def encode(self, agent, inputs, waypoint, deadline):
+        """ Returns the state id of the current step of 'agent' and counts the visit. """
+
+        state = 0
+        for positions, stride, value in zip(self.positions, self.strides, self.values(agent, inputs, waypoint, deadline)):
+            state += positions[value] * stride
+        self.visits[state] += 1
+        return state
+
+    def decode(self, state):
+        """ Returns the feature values of a state id as a tuple. """
+
+        values = []
+        for (name, feature_values), stride in zip(self.features, self.strides):
+            values.append(feature_values[state // stride % len(feature_values)])
+        return tuple(values)
+
+    def statistics(self, num_actions=len(Environment.valid_actions)):
+        """ Returns the size of the state space, the number of visited states, the
+            fraction of states never visited and the memory of a full (states, actions)
+            float Q-table. Can be called at any time during a run. """
+
+        visited = int(np.count_nonzero(self.visits))
+        return {
+            'states': self.size,
+            'visited': visited,
+            'unvisited_fraction': 1.0 - visited * 1.0 / self.size,
+            'visits': int(self.visits.sum()),
+            'max_visits': int(self.visits.max()),
+            'q_table_bytes': self.size * num_actions * 8
+        }
+
+    def most_visited(self, n=10):
+        """ Returns the 'n' most visited states as (feature values, visits) pairs. """
+
+        states = np.argsort(self.visits)[::-1][:n]
+        return [(self.decode(state), int(self.visits[state])) for state in states]
+
+
+class DefaultEncoder(StateEncoder):
+    """ The state of LearningAgent.build_state: (light, waypoint, left, oncoming[, right]). """
+
+    def __init__(self, use_input_right=True, features=()):
+        self.use_input_right = use_input_right
+        default_features = [
+            ('light', ['green', 'red']),
+            ('waypoint', Environment.valid_actions),
+            ('left', Environment.valid_actions),
+            ('oncoming', Environment.valid_actions)
+        ]
+        if self.use_input_right:
+            default_features.append(('right', Environment.valid_actions))
+        super(DefaultEncoder, self).__init__(default_features + list(features))
+
+    def values(self, agent, inputs, waypoint, deadline):
+        state = (inputs['light'], waypoint, inputs['left'], inputs['oncoming'])
+        if self.use_input_right:
+            state = state + (inputs['right'],)
+        return state
+
+
+class DeadlineEncoder(DefaultEncoder):
+    """ The default state plus the remaining deadline, bucketed by the upper
+        'bounds' of each bucket, e.g. (5, 10, 20): <= 5, <= 10, <= 20 and more. """
+
+    def __init__(self, use_input_right=True, bounds=(5, 10, 20)):
+        self.bounds = sorted(bounds)
+        super(DeadlineEncoder, self).__init__(use_input_right, [('deadline', range(len(self.bounds) + 1))])
+
+    def values(self, agent, inputs, waypoint, deadline):
+        bucket = bisect.bisect_left(self.bounds, deadline) if deadline is not None else len(self.bounds)
+        return super(DeadlineEncoder, self).values(agent, inputs, waypoint, deadline) + (bucket,)
+
+
+class HeadingEncoder(DefaultEncoder):
+    """ The default state plus the direction of the destination relative to the
+        agent's heading, as the signs of its (forward, right) offset over the
+        shortest, wrapped-around route: (1, 0) is straight ahead, (0, 0) arrived. """
+
+    def __init__(self, use_input_right=True):
+        super(HeadingEncoder, self).__init__(use_input_right, [('destination', [(f, r) for f in (-1, 0, 1) for r in (-1, 0, 1)])])
+
+    def values(self, agent, inputs, waypoint, deadline):
+        env = agent.env
+        state = env.agent_states[agent]
+        (x, y), (hx, hy) = state['location'], state['heading']
+        dx = wrap(state['destination'][0] - x, env.grid_size[0])
+        dy = wrap(state['destination'][1] - y, env.grid_size[1])
+        forward = dx * hx + dy * hy
+        right = -dx * hy + dy * hx  # Turning right changes heading (hx, hy) to (-hy, hx)
+        return super(HeadingEncoder, self).values(agent, inputs, waypoint, deadline) + ((cmp(forward, 0), cmp(right, 0)),)
+
+
+def wrap(delta, size):
+    """ Returns the shortest offset equivalent to 'delta' on a wrapped-around axis of 'size'. """
+
+    return (delta + size // 2) % size - size // 2
@@ -1,18 +1,30 @@
 import time
 import random
 import math
-from collections import OrderedDict
+import hashlib
+import numpy as np
+from collections import OrderedDict, defaultdict
 from simulator import Simulator
 
 
+def derive_seed(seed, *names):
+    """ Derives the seed of an independent random stream, identified by 'names',
+        from the master seed of a simulation. Without a master seed (None) the
+        stream is seeded from system entropy. """
+
+    if seed is None:
+        return None
+    return int(hashlib.sha256(repr((seed,) + names)).hexdigest(), 16)
+
+
 class TrafficLight(object):
     """A traffic light that switches periodically."""
 
     valid_states = [True, False]  # True = NS open; False = EW open
 
-    def __init__(self, state=None, period=None):
-        self.state = state if state is not None else random.choice(self.valid_states)
-        self.period = period if period is not None else random.choice([2, 3, 4, 5])
+    def __init__(self, state=None, period=None, rng=random):
+        self.state = state if state is not None else rng.choice(self.valid_states)
+        self.period = period if period is not None else rng.choice([2, 3, 4, 5])
         self.last_updated = 0
 
     def reset(self):
@@ -24,6 +36,28 @@ class TrafficLight(object):
             self.last_updated = t
 
 
+class LightScheduler(object):
+    """ Switches a set of traffic lights when they are due, instead of updating
+        every light each time step. Lights are bucketed by the time step of their
+        next switch, so a step only touches the lights that change. """
+
+    def __init__(self, lights):
+        self.lights = list(lights)
+        self.reset()
+
+    def reset(self):
+        self.buckets = defaultdict(list)  # Time step -> lights switching at that step
+        for light in self.lights:
+            light.reset()
+            self.buckets[light.last_updated + light.period].append(light)
+
+    def update(self, t):
+        for light in self.buckets.pop(t, ()):
+            light.state = not light.state
+            light.last_updated = t
+            self.buckets[t + light.period].append(light)
+
+
 class Environment(object):
     """Environment within which all agents operate."""
 
@@ -32,15 +66,25 @@ class Environment(object):
     valid_headings = [(1, 0), (0, -1), (-1, 0), (0, 1)]  # E, N, W, S
     hard_time_limit = -100  # Set a hard time limit even if deadline is not enforced.
 
-    def __init__(self, verbose=False, num_dummies=100, grid_size = (8, 6)):
+    def __init__(self, verbose=False, num_dummies=100, grid_size = (8, 6), seed=None):
         self.num_dummies = num_dummies  # Number of dummy driver agents in the environment
         self.verbose = verbose # If debug output should be given
 
+        # Random streams, all derived from the master seed of the simulation
+        self.seed = seed
+        self.random = self.random_stream('placement')  # Agent placement, start and destination
+        self.reward_random = self.random_stream('rewards')  # Reward noise
+        light_random = self.random_stream('lights')
+        self.quiet = False # If the per-step terminal output should be suppressed (headless runs)
+
         # Initialize simulation variables
         self.done = False
         self.t = 0
         self.agent_states = OrderedDict()
+        self.agent_order = {}  # Creation order of each agent, i.e. its position in agent_states
+        self.occupancy = defaultdict(set)  # Agents currently located at each intersection
         self.step_data = {}
+        self.recorder = None  # Optional TraceRecorder of the primary agent's steps
         self.success = None
 
         # Road network
@@ -49,25 +93,39 @@ class Environment(object):
         self.block_size = 100
         self.hang = 0.6
         self.intersections = OrderedDict()
-        self.roads = []
         for x in xrange(self.bounds[0], self.bounds[2] + 1):
             for y in xrange(self.bounds[1], self.bounds[3] + 1):
-                self.intersections[(x, y)] = TrafficLight()  # A traffic light at each intersection
+                self.intersections[(x, y)] = TrafficLight(rng=light_random)  # A traffic light at each intersection
+        self.locations = self.intersections.keys()
 
-        for a in self.intersections:
-            for b in self.intersections:
-                if a == b:
-                    continue
-                if (abs(a[0] - b[0]) + abs(a[1] - b[1])) == 1:  # L1 distance = 1
-                    self.roads.append((a, b))
+        # Initial positions of dummy agents, one (location, heading) slot per agent
+        self.slots = [(location, heading) for location in self.locations for heading in self.valid_headings]
+
+        self.light_scheduler = LightScheduler(self.intersections.itervalues())
+
+        # Roads between intersections at L1 distance 1, read off the grid: one row of
+        # 'road_links' per road, holding the indices (in 'intersections' order) of its ends
+        index = np.arange(len(self.intersections)).reshape(self.grid_size)
+        self.road_links = np.concatenate((
+            np.column_stack((index[:-1, :].ravel(), index[1:, :].ravel())),  # East-west roads
+            np.column_stack((index[:, :-1].ravel(), index[:, 1:].ravel()))   # North-south roads
+        ))
 
         # Add environment boundaries
-        for x in xrange(self.bounds[0], self.bounds[2] + 1):
-            self.roads.append(((x, self.bounds[1] - self.hang), (x, self.bounds[1])))
-            self.roads.append(((x, self.bounds[3] + self.hang), (x, self.bounds[3])))
-        for y in xrange(self.bounds[1], self.bounds[3] + 1):
-            self.roads.append(((self.bounds[0] - self.hang, y), (self.bounds[0], y)))
-            self.roads.append(((self.bounds[2] + self.hang, y), (self.bounds[2], y)))    
+        x = np.arange(self.bounds[0], self.bounds[2] + 1, dtype=float)
+        y = np.arange(self.bounds[1], self.bounds[3] + 1, dtype=float)
+        boundaries = [
+            ((x, self.bounds[1] - self.hang), (x, self.bounds[1])),
+            ((x, self.bounds[3] + self.hang), (x, self.bounds[3])),
+            ((self.bounds[0] - self.hang, y), (self.bounds[0], y)),
+            ((self.bounds[2] + self.hang, y), (self.bounds[2], y))
+        ]
+
+        # End points of every road to draw as a (roads, 2, 2) array
+        locations = np.array(self.locations, dtype=float)
+        self.road_segments = np.concatenate([locations[self.road_links]] +
+            [np.stack(np.broadcast_arrays(a[0], a[1], b[0], b[1]), axis=1).reshape(-1, 2, 2) for a, b in boundaries])
+        self.roads = [(tuple(a), tuple(b)) for a, b in self.road_segments.tolist()]
 
         # Create dummy agents
         for i in xrange(self.num_dummies):
@@ -77,6 +135,12 @@ class Environment(object):
         self.primary_agent = None  # to be set explicitly
         self.enforce_deadline = False
 
+        # Learning agents with their own route, deadline and trial data, the primary agent first
+        self.learners = []
+        self.learner_data = {}  # Trial data of each learner, the primary agent's is 'trial_data'
+        self.finished = set()   # Learners that reached their destination or deadline in this trial
+        self.step_hooks = []    # Called at the end of every step, e.g. to apply batched Q-updates
+
         # Trial data (updated at the end of each trial)
         self.trial_data = {
             'testing': False, # if the trial is for testing a learned policy
@@ -92,7 +156,10 @@ class Environment(object):
         """ When called, create_agent creates an agent in the environment. """
 
         agent = agent_class(self, *args, **kwargs)
-        self.agent_states[agent] = {'location': random.choice(self.intersections.keys()), 'heading': (0, 1)}
+        location = self.random.choice(self.locations)
+        self.agent_states[agent] = {'location': location, 'heading': (0, 1)}
+        self.agent_order[agent] = len(self.agent_order)
+        self.occupancy[location].add(agent)
         return agent
 
     def set_primary_agent(self, agent, enforce_deadline=False):
@@ -103,6 +170,23 @@ class Environment(object):
         agent.primary_agent = True
         self.enforce_deadline = enforce_deadline
 
+        if agent in self.learners:
+            self.learners.remove(agent)
+        self.learners.insert(0, agent)
+        self.learner_data[agent] = self.trial_data
+
+    def add_learner(self, agent):
+        """ Lets 'agent' learn alongside the primary agent. Like the primary agent it
+            gets its own start, destination and deadline every trial, and its trial
+            data is collected in 'learner_data'. A learner stops acting when it is
+            done, the trial ends when the primary agent is done. """
+
+        if agent in self.learners:
+            return
+        agent.primary_agent = True  # Has a route and a deadline
+        self.learners.append(agent)
+        self.learner_data[agent] = dict(self.trial_data, actions={0: 0, 1: 0, 2: 0, 3: 0, 4: 0})
+
     def reset(self, testing=False):
         """ This function is called at the beginning of a new trial. """
 
@@ -113,109 +197,112 @@ class Environment(object):
         self.step_data = {}
 
         # Reset traffic lights
-        for traffic_light in self.intersections.itervalues():
-            traffic_light.reset()
-
-        # Pick a start and a destination
-        start = random.choice(self.intersections.keys())
-        destination = random.choice(self.intersections.keys())
-
-        # Ensure starting location and destination are not too close
-        while self.compute_dist(start, destination) < 4:
-            start = random.choice(self.intersections.keys())
-            destination = random.choice(self.intersections.keys())
-
-        start_heading = random.choice(self.valid_headings)
-        distance = self.compute_dist(start, destination)
-        deadline = distance * 5 # 5 time steps per intersection away
-        if(self.verbose == True): # Debugging
-            print "Environment.reset(): Trial set up with start = {}, destination = {}, deadline = {}".format(start, destination, deadline)
-
-        # Create a map of all possible initial positions
-        positions = dict()
-        for location in self.intersections:
-            positions[location] = list()
-            for heading in self.valid_headings:
-                positions[location].append(heading)
+        self.light_scheduler.reset()
+
+        # Pick a start and a destination for every learner, the primary agent first
+        self.finished = set()
+        routes = {}
+        for learner in self.learners:
+            start = self.random.choice(self.locations)
+            destination = self.random.choice(self.locations)
+
+            # Ensure starting location and destination are not too close
+            while self.compute_dist(start, destination) < 4:
+                start = self.random.choice(self.locations)
+                destination = self.random.choice(self.locations)
+
+            start_heading = self.random.choice(self.valid_headings)
+            distance = self.compute_dist(start, destination)
+            deadline = distance * 5 # 5 time steps per intersection away
+            routes[learner] = (start, start_heading, destination, deadline)
+            if(self.verbose == True and learner is self.primary_agent): # Debugging
+                print "Environment.reset(): Trial set up with start = {}, destination = {}, deadline = {}".format(start, destination, deadline)
+
+        # Draw distinct initial positions for the dummy agents
+        slots = iter(self.sample_slots(len(self.agent_states) - len(routes)))
 
         # Initialize agent(s)
         for agent in self.agent_states.iterkeys():
+            previous_location = self.agent_states[agent]['location']
 
-            if agent is self.primary_agent:
+            if agent in routes:
+                start, start_heading, destination, deadline = routes[agent]
                 self.agent_states[agent] = {
                     'location': start,
                     'heading': start_heading,
                     'destination': destination,
                     'deadline': deadline
                 }
-            # For dummy agents, make them choose one of the available 
-            # intersections and headings still in 'positions'
+            # For dummy agents, take the next of the drawn slots
             else:
-                intersection = random.choice(positions.keys())
-                heading = random.choice(positions[intersection])
+                intersection, heading = next(slots)
                 self.agent_states[agent] = {
                     'location': intersection,
                     'heading': heading,
                     'destination': None,
                     'deadline': None
                 }
-                # Now delete the taken location and heading from 'positions'
-                positions[intersection] = list(set(positions[intersection]) - set([heading]))
-                if positions[intersection] == list(): # No headings available for intersection
-                    del positions[intersection] # Delete the intersection altogether
+
+            self.update_occupancy(agent, previous_location, self.agent_states[agent]['location'])
 
     
-            agent.reset(destination=(destination if agent is self.primary_agent else None), testing=testing)
-            if agent is self.primary_agent:
+            agent.reset(destination=(routes[agent][2] if agent in routes else None), testing=testing)
+            if agent in routes:
                 # Reset metrics for this trial (step data will be set during the step)
-                self.trial_data['testing'] = testing
-                self.trial_data['initial_deadline'] = deadline
-                self.trial_data['final_deadline'] = deadline
-                self.trial_data['net_reward'] = 0.0
-                self.trial_data['actions'] = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0}
-                self.trial_data['parameters'] = {'e': agent.epsilon, 'a': agent.alpha}
-                self.trial_data['success'] = 0
+                trial_data = self.learner_data[agent]
+                trial_data['testing'] = testing
+                trial_data['initial_deadline'] = routes[agent][3]
+                trial_data['final_deadline'] = routes[agent][3]
+                trial_data['net_reward'] = 0.0
+                trial_data['actions'] = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0}
+                trial_data['parameters'] = {'e': agent.epsilon, 'a': agent.alpha}
+                trial_data['success'] = 0
 
     def step(self):
         """ This function is called when a time step is taken turing a trial. """
 
         # Pretty print to terminal
-        print ""
-        print "/-------------------"
-        print "| Step {} Results".format(self.t)
-        print "\-------------------"
-        print ""
+        if not self.quiet:
+            print ""
+            print "/-------------------"
+            print "| Step {} Results".format(self.t)
+            print "\-------------------"
+            print ""
 
         if(self.verbose == True): # Debugging
             print "Environment.step(): t = {}".format(self.t)
 
-        # Update agents, primary first
-        if self.primary_agent is not None:
-            self.primary_agent.update()
+        # Update agents, learners first (primary first), finished learners no longer act
+        active = [learner for learner in self.learners if learner not in self.finished]
+        for learner in active:
+            learner.update()
 
         for agent in self.agent_states.iterkeys():
-            if agent is not self.primary_agent:
+            if agent not in self.learner_data:
                 agent.update()
 
+        for hook in self.step_hooks:
+            hook()
+
         # Update traffic lights
-        for intersection, traffic_light in self.intersections.iteritems():
-            traffic_light.update(self.t)
+        self.light_scheduler.update(self.t)
 
-        if self.primary_agent is not None:
+        for learner in active:
             # Agent has taken an action: reduce the deadline by 1
-            agent_deadline = self.agent_states[self.primary_agent]['deadline'] - 1
-            self.agent_states[self.primary_agent]['deadline'] = agent_deadline
+            agent_deadline = self.agent_states[learner]['deadline'] - 1
+            self.agent_states[learner]['deadline'] = agent_deadline
 
-            if agent_deadline <= self.hard_time_limit:
-                self.done = True
-                self.success = False
-                if self.verbose: # Debugging
-                    print "Environment.step(): Primary agent hit hard time limit ({})! Trial aborted.".format(self.hard_time_limit)
-            elif self.enforce_deadline and agent_deadline <= 0:
+            if agent_deadline <= self.hard_time_limit or (self.enforce_deadline and agent_deadline <= 0):
+                self.finished.add(learner)
+                if learner is not self.primary_agent:
+                    continue
                 self.done = True
                 self.success = False
                 if self.verbose: # Debugging
-                    print "Environment.step(): Primary agent ran out of time! Trial aborted."
+                    if agent_deadline <= self.hard_time_limit:
+                        print "Environment.step(): Primary agent hit hard time limit ({})! Trial aborted.".format(self.hard_time_limit)
+                    else:
+                        print "Environment.step(): Primary agent ran out of time! Trial aborted."
 
         self.t += 1
 
@@ -231,15 +318,17 @@ class Environment(object):
         light = 'green' if (self.intersections[location].state and heading[1] != 0) or ((not self.intersections[location].state) and heading[0] != 0) else 'red'
 
         # Populate oncoming, left, right
+        # Only agents at the same intersection are considered, visited in agent_states order
         oncoming = None
         left = None
         right = None
-        for other_agent, other_state in self.agent_states.iteritems():
-            if agent == other_agent or location != other_state['location'] or (heading[0] == other_state['heading'][0] and heading[1] == other_state['heading'][1]):
+        for other_agent in sorted(self.occupancy.get(location, ()), key=self.agent_order.__getitem__):
+            other_state = self.agent_states[other_agent]
+            if agent == other_agent or (heading[0] == other_state['heading'][0] and heading[1] == other_state['heading'][1]):
                 continue
-            # For dummy agents, ignore the primary agent
-            # This is because the primary agent is not required to follow the waypoint
-            if other_agent == self.primary_agent:
+            # For dummy agents, ignore the primary agent and the other learners
+            # This is because learning agents are not required to follow the waypoint
+            if other_agent in self.learner_data:
                 continue
             other_heading = other_agent.get_next_waypoint()
             if (heading[0] * other_state['heading'][0] + heading[1] * other_state['heading'][1]) == -1:
@@ -257,7 +346,7 @@ class Environment(object):
     def get_deadline(self, agent):
         """ Returns the deadline remaining for an agent. """
 
-        return self.agent_states[agent]['deadline'] if agent is self.primary_agent else None
+        return self.agent_states[agent]['deadline'] if agent in self.learner_data else None
 
     def act(self, agent, action):
         """ Consider an action and perform the action if it is legal.
@@ -283,7 +372,7 @@ class Environment(object):
 
         # Reward scheme
         # First initialize reward uniformly random from [-1, 1]
-        reward = 2 * random.random() - 1
+        reward = 2 * self.reward_random.random() - 1
 
         # Create a penalty factor as a function of remaining deadline
         # Scales reward multiplicatively from [0, 1]
@@ -347,6 +436,7 @@ class Environment(object):
             if action is not None:
                 location = ((location[0] + heading[0] - self.bounds[0]) % (self.bounds[2] - self.bounds[0] + 1) + self.bounds[0],
                             (location[1] + heading[1] - self.bounds[1]) % (self.bounds[3] - self.bounds[1] + 1) + self.bounds[1])  # wrap-around
+                self.update_occupancy(agent, state['location'], location)
                 state['location'] = location
                 state['heading'] = heading
         # Agent attempted invalid move
@@ -360,6 +450,18 @@ class Environment(object):
             elif violation == 4: # Major accident
                 reward += -40
 
+        # Did a learner reach the goal after a valid move?
+        if agent in self.learner_data and agent is not self.primary_agent:
+            trial_data = self.learner_data[agent]
+            if state['location'] == state['destination']:
+                if state['deadline'] >= 0:
+                    trial_data['success'] = 1
+                self.finished.add(agent)
+
+            trial_data['final_deadline'] = state['deadline'] - 1
+            trial_data['net_reward'] += reward
+            trial_data['actions'][violation] += 1
+
         # Did agent reach the goal after a valid move?
         if agent is self.primary_agent:
             if state['location'] == state['destination']:
@@ -370,6 +472,7 @@ class Environment(object):
                 # Stop the trial
                 self.done = True
                 self.success = True
+                self.finished.add(agent)
 
                 if(self.verbose == True): # Debugging
                     print "Environment.act(): Primary agent has reached destination!"
@@ -392,10 +495,38 @@ class Environment(object):
             self.trial_data['net_reward'] += reward
             self.trial_data['actions'][violation] += 1
 
+            if self.recorder is not None:
+                self.recorder.record(agent)
+
             if(self.verbose == True): # Debugging
                 print "Environment.act(): Step data: {}".format(self.step_data)
         return reward
 
+    def update_occupancy(self, agent, old_location, new_location):
+        """ Move 'agent' from 'old_location' to 'new_location' in the occupancy index
+            used by sense to find the agents sharing an intersection. """
+
+        if old_location == new_location:
+            return
+
+        occupants = self.occupancy[old_location]
+        occupants.discard(agent)
+        if not occupants: # Keep the index limited to occupied intersections
+            del self.occupancy[old_location]
+        self.occupancy[new_location].add(agent)
+
+    def sample_slots(self, n):
+        """ Returns 'n' distinct (location, heading) slots drawn uniformly without
+            replacement, so no two agents start at the same place facing the same way.
+            Costs O(n), independent of the number of intersections. """
+
+        return [self.slots[i] for i in self.random.sample(xrange(len(self.slots)), n)]
+
+    def random_stream(self, *names):
+        """ Returns a new random generator for the stream identified by 'names'. """
+
+        return random.Random(derive_seed(self.seed, *names))
+
     def compute_dist(self, a, b):
         """ Compute the Manhattan (L1) distance of a spherical world. """
 
@@ -416,6 +547,7 @@ class Agent(object):
 
     def __init__(self, env):
         self.env = env
+        self.random = env.random_stream('agent', len(env.agent_states))  # One stream per agent, by creation order
         self.state = None
         self.next_waypoint = None
         self.color = 'white'
@@ -439,8 +571,8 @@ class DummyAgent(Agent):
 
     def __init__(self, env):
         super(DummyAgent, self).__init__(env)  # sets self.env = env, state = None, next_waypoint = None, and a default color
-        self.next_waypoint = random.choice(Environment.valid_actions[1:])
-        self.color = random.choice(self.color_choices)
+        self.next_waypoint = self.random.choice(Environment.valid_actions[1:])
+        self.color = self.random.choice(self.color_choices)
 
     def update(self):
         """ Update a DummyAgent to move randomly under legal traffic laws. """
@@ -463,5 +595,5 @@ class DummyAgent(Agent):
         action = None
         if action_okay:
             action = self.next_waypoint
-            self.next_waypoint = random.choice(Environment.valid_actions[1:])
+            self.next_waypoint = self.random.choice(Environment.valid_actions[1:])
         reward = self.env.act(self, action)
\ No newline at end of file
@@ -0,0 +1,196 @@
+import sys
+import math
+import time
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+from environment import Environment, derive_seed
+from vector_environment import VectorEnvironment, VectorLearningAgent
+from checkpoint import load_q_table
+from metrics import field_names
+
+
+def q_array(Q, use_input_right=True):
+    """ Converts a Q-table of LearningAgent (dict or QTable) into the (states, actions)
+        array of VectorLearningAgent. States missing from 'Q' keep Q-values of 0.0,
+        so the greedy choice between all actions is random, as for LearningAgent. """
+
+    codes = dict((action, i) for i, action in enumerate(Environment.valid_actions))
+    num_inputs = 4 if use_input_right else 3
+    table = np.zeros((2 * len(codes) ** num_inputs, len(codes)))
+    for state in Q:
+        assert isinstance(state, tuple) and len(state) == num_inputs + 1, "Only Q-tables of the default state tuples can be evaluated!"
+        row = int(state[0] == 'green')
+        for value in state[1:]:
+            row = row * len(codes) + codes[value]
+        table[row] = [Q[state][action] for action in Environment.valid_actions]
+    return table
+
+
+def run_episodes(task):
+    """ Runs the testing episodes of 'task' in the worlds of one VectorEnvironment
+        and returns their metrics as a DataFrame with the columns of a MetricsLog.
+        'task' holds the arguments of evaluate, with 'table' from q_array. """
+
+    env = VectorEnvironment(num_worlds=min(task['num_worlds'], task['n_episodes']), num_dummies=task['num_dummies'],
+                            grid_size=task['grid_size'], seed=task['seed'])
+    agent = VectorLearningAgent(env, learning=True, epsilon=0.0, alpha=0.0, use_input_right=task['use_input_right'])
+    agent.Q[:] = task['table']
+    env.set_primary_agent(agent, enforce_deadline=task['enforce_deadline'])
+
+    ended_trials = []
+    started = 0
+    running = np.zeros(env.num_worlds, dtype=bool)
+    begin = np.ones(env.num_worlds, dtype=bool)
+    while True:
+        # Start new episodes in the worlds that are free, until enough were started
+        worlds = np.flatnonzero(begin)[:task['n_episodes'] - started]
+        if len(worlds) > 0:
+            env.reset(testing=True, worlds=worlds)
+            running[worlds] = True
+            started += len(worlds)
+        if not running.any():
+            break
+
+        env.step()
+
+        # Collect metrics from finished episodes
+        ended = np.flatnonzero(env.done & running)
+        if len(ended) > 0:
+            data = env.trial_data
+            ended_trials.append(np.column_stack((
+                np.zeros(len(ended)), np.ones(len(ended)), np.zeros(len(ended)), np.zeros(len(ended)),
+                data['initial_deadline'][ended], data['final_deadline'][ended], data['net_reward'][ended],
+                data['actions'][ended], data['success'][ended])))
+        running[ended] = False
+        begin = env.done.copy()
+
+    trials = pd.DataFrame(np.concatenate(ended_trials), columns=field_names)
+    for name in field_names:
+        if name not in ('epsilon', 'alpha', 'net_reward'):
+            trials[name] = trials[name].astype(bool if name == 'testing' else int)
+    return trials
+
+
+def wilson_interval(successes, n, z=1.96):
+    """ Returns the Wilson score interval of a proportion of 'successes' out of 'n',
+        at the confidence level of the normal quantile 'z' (1.96: 95%). """
+
+    if n == 0:
+        return (0.0, 1.0)
+    p = successes * 1.0 / n
+    denominator = 1.0 + z * z / n
+    center = (p + z * z / (2.0 * n)) / denominator
+    half_width = z * math.sqrt(p * (1.0 - p) / n + z * z / (4.0 * n * n)) / denominator
+    return (center - half_width, center + half_width)
+
+
+def evaluate(Q, n_episodes=1000, num_worlds=100, processes=1, grid_size=(8, 6), num_dummies=100, enforce_deadline=True,
+             use_input_right=None, seed=None, z=1.96, n_bootstrap=200):
+    """ Tests a frozen Q-table over many episodes and rates it like smartcab/visuals.py.
+
+        'Q' is the Q-table of a LearningAgent (dict or QTable) or a checkpoint file
+        'n_episodes' is the number of testing episodes, with epsilon and alpha 0
+        'num_worlds' is the number of worlds of a VectorEnvironment stepped in lockstep
+        'processes' splits the episodes over a process pool when above 1
+        'use_input_right' is read off the states of 'Q' if not set
+        'seed' is the master seed of the random streams of every process
+        'z' is the normal quantile of the confidence intervals (1.96: 95%)
+        'n_bootstrap' is the number of resamples of the episodes rated to estimate
+        how often each rating comes up
+
+        Returns a dict with the 'safety' and 'reliability' ratings of all episodes,
+        the Wilson intervals of the success rate and of the fraction of good actions,
+        the bootstrap frequency of every rating and the episodes as 'trials'. """
+
+    import visuals # Requires the top-level project directory on the path
+
+    if isinstance(Q, basestring):
+        Q = load_q_table(Q)
+    if use_input_right is None:
+        use_input_right = all(len(state) == 5 for state in Q)
+    table = q_array(Q, use_input_right)
+
+    # One task per process, with its own share of the episodes and its own seed
+    processes = max(1, min(processes, n_episodes))
+    tasks = [{
+        'table': table,
+        'n_episodes': n_episodes // processes + (i < n_episodes % processes),
+        'num_worlds': num_worlds,
+        'grid_size': grid_size,
+        'num_dummies': num_dummies,
+        'enforce_deadline': enforce_deadline,
+        'use_input_right': use_input_right,
+        'seed': derive_seed(seed, 'evaluation', i)
+    } for i in xrange(processes)]
+
+    start = time.time()
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            parts = pool.map(run_episodes, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        parts = [run_episodes(task) for task in tasks]
+    elapsed = time.time() - start
+
+    trials = pd.concat(parts, ignore_index=True)
+    trials['trial'] = np.arange(1, len(trials) + 1)
+
+    # How often each rating comes up when the episodes are resampled
+    rng = np.random.RandomState(None if seed is None else derive_seed(seed, 'bootstrap') % 2**32)
+    safety_ratings, reliability_ratings = {}, {}
+    for i in xrange(n_bootstrap):
+        sample = trials.iloc[rng.randint(len(trials), size=len(trials))]
+        safety = visuals.calculate_safety(sample)[0]
+        reliability = visuals.calculate_reliability(sample)[0]
+        safety_ratings[safety] = safety_ratings.get(safety, 0) + 1.0 / n_bootstrap
+        reliability_ratings[reliability] = reliability_ratings.get(reliability, 0) + 1.0 / n_bootstrap
+
+    steps = (trials['initial_deadline'] - trials['final_deadline']).sum()
+    return {
+        'episodes': len(trials),
+        'episodes_per_second': len(trials) / elapsed if elapsed > 0 else float('inf'),
+        'safety': visuals.calculate_safety(trials)[0],
+        'reliability': visuals.calculate_reliability(trials)[0],
+        'success_rate': trials['success'].mean(),
+        'success_interval': wilson_interval(trials['success'].sum(), len(trials), z),
+        'good_ratio': trials['good_actions'].sum() * 1.0 / steps,
+        'good_ratio_interval': wilson_interval(trials['good_actions'].sum(), steps, z),
+        'safety_ratings': safety_ratings,
+        'reliability_ratings': reliability_ratings,
+        'trials': trials
+    }
+
+
+def report(result):
+    """ Returns the ratings and intervals of an evaluation as text. """
+
+    lines = [
+        "{} testing episodes ({:.0f} episodes/second)".format(result['episodes'], result['episodes_per_second']),
+        "Safety rating: {} (fraction of good actions {:.4f}, interval {:.4f} - {:.4f})".format(
+            result['safety'], result['good_ratio'], *result['good_ratio_interval']),
+        "Reliability rating: {} (success rate {:.4f}, interval {:.4f} - {:.4f})".format(
+            result['reliability'], result['success_rate'], *result['success_interval'])
+    ]
+    for name in ['safety', 'reliability']:
+        ratings = result['{}_ratings'.format(name)]
+        lines.append("{} ratings of resampled episodes: {}".format(name.capitalize(),
+                     ", ".join("{} {:.0%}".format(rating, ratings[rating]) for rating in sorted(ratings, key=ratings.get, reverse=True))))
+    return "\n".join(lines)
+
+
+def main(args):
+    """ Evaluates the Q-table of a checkpoint, run from the top-level project directory
+        with 'python -m smartcab.evaluation logs/agent.npz [episodes] [processes]'. """
+
+    n_episodes = int(args[1]) if len(args) > 1 else 1000
+    processes = int(args[2]) if len(args) > 2 else 1
+    print report(evaluate(args[0], n_episodes=n_episodes, processes=processes))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
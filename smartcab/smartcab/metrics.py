@@ -0,0 +1,91 @@
+import os
+import csv
+import numpy as np
+
+# Typed columns of a metrics log, one per violation class (see Environment.act)
+fields = [
+    ('trial', int),
+    ('testing', bool),
+    ('epsilon', float),
+    ('alpha', float),
+    ('initial_deadline', int),
+    ('final_deadline', int),
+    ('net_reward', float),
+    ('good_actions', int),      # 0: Action okay
+    ('minor_violations', int),  # 1: Minor traffic violation
+    ('major_violations', int),  # 2: Major traffic violation
+    ('minor_accidents', int),   # 3: Minor traffic violation causing an accident
+    ('major_accidents', int),   # 4: Major traffic violation causing an accident
+    ('success', int)
+]
+field_names = [name for name, dtype in fields]
+violation_fields = field_names[7:12]
+
+
+class MetricsLog(object):
+    """ Buffered trial log that writes one typed column per metric instead of the
+        stringified 'parameters' and 'actions' dicts of the default Simulator log.
+
+        The format follows the extension of 'filename': '.csv' appends the buffered
+        rows every 'batch_size' trials, '.npz' keeps the batches as typed arrays
+        and writes one compressed NumPy archive when the log is closed. """
+
+    def __init__(self, filename, batch_size=1000):
+        self.filename = filename
+        self.format = os.path.splitext(filename)[1].lstrip('.')
+        assert self.format in ('csv', 'npz'), "Unknown metrics log format!"
+        self.batch_size = batch_size
+        self.rows = []      # Trials not yet written
+        self.batches = []   # Typed columns of the written batches ('npz' only)
+
+        if self.format == 'csv':
+            self.file = open(self.filename, 'wb')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(field_names)
+
+    def append(self, trial, trial_data):
+        """ Buffers the metrics of a finished trial, as collected in Environment.trial_data. """
+
+        actions = trial_data['actions']
+        self.rows.append((trial, trial_data['testing'], trial_data['parameters']['e'], trial_data['parameters']['a'],
+                          trial_data['initial_deadline'], trial_data['final_deadline'], trial_data['net_reward'],
+                          actions[0], actions[1], actions[2], actions[3], actions[4], trial_data['success']))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Writes the buffered trials. """
+
+        if not self.rows:
+            return
+
+        if self.format == 'csv':
+            self.writer.writerows(self.rows)
+            self.file.flush()
+        else:
+            columns = zip(*self.rows)
+            self.batches.append([np.array(column, dtype=dtype) for column, (name, dtype) in zip(columns, fields)])
+        self.rows = []
+
+    def close(self):
+        """ Writes the remaining trials and closes the log. """
+
+        self.flush()
+        if self.format == 'csv':
+            self.file.close()
+        else:
+            columns = {}
+            for i, (name, dtype) in enumerate(fields):
+                columns[name] = np.concatenate([batch[i] for batch in self.batches]) if self.batches else np.zeros(0, dtype=dtype)
+            np.savez_compressed(self.filename, **columns)
+
+
+def load(filename):
+    """ Reads a metrics log written by MetricsLog as a dict of typed column arrays. """
+
+    if filename.endswith('.npz'):
+        archive = np.load(filename)
+        return dict((name, archive[name]) for name in field_names)
+
+    table = np.atleast_1d(np.genfromtxt(filename, delimiter=',', names=True, dtype=[dtype for name, dtype in fields]))
+    return dict((name, table[name]) for name in field_names)
@@ -1,17 +1,20 @@
-import random
+import numpy as np
 
 class RoutePlanner(object):
     """ Complex route planner that is meant for a perpendicular grid network. """
 
-    def __init__(self, env, agent):
+    def __init__(self, env, agent, use_table=False):
         self.env = env
         self.agent = agent
         self.destination = None
 
+        # Optionally look the waypoints up in a table precomputed for the grid
+        self.table = waypoint_table(env.grid_size, env.valid_headings, env.valid_actions) if use_table else None
+
     def route_to(self, destination=None):
         """ Select the destination if one is provided, otherwise choose a random intersection. """
 
-        self.destination = destination if destination is not None else random.choice(self.env.intersections.keys())
+        self.destination = destination if destination is not None else self.agent.random.choice(self.env.locations)
 
     def next_waypoint(self):
         """ Creates the next waypoint based on current heading, location,
@@ -22,6 +25,9 @@ class RoutePlanner(object):
         location = self.env.agent_states[self.agent]['location']
         heading = self.env.agent_states[self.agent]['heading']
 
+        if self.table is not None:
+            return self.table.lookup(location, heading, self.destination)
+
         delta_a = (self.destination[0] - location[0], self.destination[1] - location[1])
         delta_b = (bounds[0] + delta_a[0] if delta_a[0] <= 0 else delta_a[0] - bounds[0], \
                    bounds[1] + delta_a[1] if delta_a[1] <= 0 else delta_a[1] - bounds[1])
@@ -73,4 +79,82 @@ class RoutePlanner(object):
             elif dy * heading[0] > 0: # Heading West destination North; Heading East destination South
                 return 'right'
             else:
-                return 'left'
\ No newline at end of file
+                return 'left'
+
+
+class WaypointTable(object):
+    """ Dense table of the waypoints of RoutePlanner for a fixed grid, indexed by the
+        offset of the destination from the location and by the heading.
+
+        The raw offset (not the wrapped one) is used, since RoutePlanner breaks ties
+        between equally short ways around the world by the sign of the raw offset. """
+
+    def __init__(self, grid_size, headings, actions):
+        self.grid_size = grid_size
+        self.actions = list(actions)
+        self.heading_ids = dict((heading, i) for i, heading in enumerate(headings))
+
+        # Offsets range from -(size - 1) to (size - 1) along each axis
+        dx, dy = np.meshgrid(np.arange(1 - grid_size[0], grid_size[0]), np.arange(1 - grid_size[1], grid_size[1]), indexing='ij')
+        hx, hy = np.array(headings, dtype=int).T
+
+        # Calculate true difference in location based on world-wrap (see RoutePlanner.next_waypoint)
+        def wrap(delta_a, bound):
+            delta_b = np.where(delta_a <= 0, bound + delta_a, delta_a - bound)
+            return np.where(np.abs(delta_a) < np.abs(delta_b), delta_a, delta_b)[..., np.newaxis]
+        dx = wrap(dx, grid_size[0])
+        dy = wrap(dy, grid_size[1])
+
+        none, forward, left, right = [self.actions.index(action) for action in (None, 'forward', 'left', 'right')]
+
+        # Destination cardinally East or West of location
+        east_west = np.select([dx * hx > 0,
+                               (dx * hx < 0) & (hx < 0),
+                               (dx * hx < 0) & (hx > 0),
+                               dx * hy > 0],
+                              [forward,
+                               np.where(dy > 0, left, right),
+                               np.where(dy < 0, left, right),
+                               left],
+                              right)
+
+        # Destination cardinally North or South of location
+        north_south = np.select([dy * hy > 0,
+                                 (dy * hy < 0) & (hy < 0),
+                                 (dy * hy < 0) & (hy > 0),
+                                 dy * hx > 0],
+                                [forward,
+                                 np.where(dx < 0, left, right),
+                                 np.where(dx > 0, left, right),
+                                 right],
+                                left)
+
+        # Waypoints as indices of 'actions', with shape (x offsets, y offsets, headings)
+        self.codes = np.select([(dx == 0) & (dy == 0), dx != 0], [none, east_west], north_south)
+        self.waypoints = [self.actions[code] for code in self.codes.ravel()]
+
+    def lookup(self, location, heading, destination):
+        """ Returns the next waypoint from 'location' with 'heading' to 'destination'. """
+
+        x = destination[0] - location[0] + self.grid_size[0] - 1
+        y = destination[1] - location[1] + self.grid_size[1] - 1
+        return self.waypoints[(x * self.codes.shape[1] + y) * self.codes.shape[2] + self.heading_ids[heading]]
+
+    def lookup_batch(self, location, heading, destination):
+        """ Returns the next waypoints, as indices of 'actions', for arrays of locations,
+            heading indices and destinations. """
+
+        offset = np.asarray(destination) - location + (self.grid_size[0] - 1, self.grid_size[1] - 1)
+        return self.codes[offset[..., 0], offset[..., 1], heading]
+
+
+_waypoint_tables = {}
+
+def waypoint_table(grid_size, headings, actions):
+    """ Returns the WaypointTable of a grid, shared by all planners of that grid. """
+
+    key = (tuple(grid_size), tuple(headings), tuple(actions))
+    if key not in _waypoint_tables:
+        _waypoint_tables[key] = WaypointTable(grid_size, headings, actions)
+    return _waypoint_tables[key]
+
@@ -0,0 +1,115 @@
+import sys
+import json
+from timeit import default_timer as timer
+
+
+class Profiler(object):
+    """ Cumulative timers and call counters per phase of a simulation.
+
+        'attach' wraps the methods of a simulator, its environment and agents in
+        timed versions, so nothing is measured (or slowed down) unless a profiler
+        is attached. Terminal output is timed between 'start' and 'stop'. Phases
+        nest: 'sense' is part of the agent updates that call it, and every phase
+        is part of 'run'. """
+
+    def __init__(self):
+        self.seconds = {}  # Phase -> cumulative seconds
+        self.calls = {}    # Phase -> number of calls
+        self.stdout = None
+
+    def timed(self, function, phase):
+        """ Returns 'function' timed as 'phase'. """
+
+        self.seconds.setdefault(phase, 0.0)
+        self.calls.setdefault(phase, 0)
+
+        def timed_function(*args, **kwargs):
+            started = timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds[phase] += timer() - started
+                self.calls[phase] += 1
+        return timed_function
+
+    def attach(self, sim):
+        """ Times the phases of 'sim' and its environment: the primary, learner and dummy
+            updates, sense and act calls, light updates, logging and rendering. """
+
+        env = sim.env
+        env.step = self.timed(env.step, 'step')
+        env.sense = self.timed(env.sense, 'sense')
+        env.act = self.timed(env.act, 'act')
+        env.light_scheduler.update = self.timed(env.light_scheduler.update, 'light updates')
+        for agent in env.agent_states:
+            if agent is env.primary_agent:
+                phase = 'primary update'
+            elif agent in env.learner_data:
+                phase = 'learner updates'
+            else:
+                phase = 'dummy updates'
+            agent.update = self.timed(agent.update, phase)
+
+        sim.log_trial = self.timed(sim.log_trial, 'logging')
+        sim.render = self.timed(sim.render, 'rendering')
+        sim.render_text = self.timed(sim.render_text, 'rendering text')
+
+    def start(self):
+        """ Starts timing the writes to the terminal. """
+
+        self.stdout = sys.stdout
+        sys.stdout = TimedStream(self.stdout, self.timed(self.stdout.write, 'stdout'))
+
+    def stop(self):
+        """ Restores the terminal output. """
+
+        if self.stdout is not None:
+            sys.stdout = self.stdout
+            self.stdout = None
+
+    def add(self, phase, seconds, calls=1):
+        """ Adds time measured outside of 'attach', e.g. the total of a run. """
+
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + calls
+
+    def breakdown(self):
+        """ Returns the phases as a list of dicts, from slowest to fastest. """
+
+        total = self.seconds.get('run', 0.0)
+        phases = []
+        for phase in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            seconds, calls = self.seconds[phase], self.calls[phase]
+            phases.append({
+                'phase': phase,
+                'seconds': seconds,
+                'calls': calls,
+                'microseconds_per_call': seconds * 1e6 / calls if calls else 0.0,
+                'fraction_of_run': seconds / total if total else 0.0
+            })
+        return phases
+
+    def report(self):
+        """ Returns the breakdown as a text table. """
+
+        lines = ["{:<16}{:>12}{:>12}{:>14}{:>10}".format('phase', 'seconds', 'calls', 'us/call', '% run')]
+        for phase in self.breakdown():
+            lines.append("{phase:<16}{seconds:>12.3f}{calls:>12}{microseconds_per_call:>14.1f}{fraction_of_run:>10.1%}".format(**phase))
+        return "\n".join(lines)
+
+    def save(self, filename):
+        """ Writes the breakdown as JSON. """
+
+        with open(filename, 'wb') as f:
+            json.dump(self.breakdown(), f, indent=2)
+
+
+class TimedStream(object):
+    """ File-like wrapper of a stream whose writes are timed. """
+
+    def __init__(self, stream, write):
+        self.stream = stream
+        self.write = write
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
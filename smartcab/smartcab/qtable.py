@@ -0,0 +1,128 @@
+import random
+import numpy as np
+
+
+class QTable(object):
+    """ A tabular Q-function stored as one contiguous (states, actions) float array.
+
+        States are interned into integer ids in the order they are first added.
+        The table can be used like the dict-of-dicts Q-table of LearningAgent:
+        'state in Q', 'Q[state] = dict.fromkeys(actions, 0.0)', 'Q[state][action]'
+        and iteration over the states all behave the same. """
+
+    def __init__(self, actions, capacity=1024, rng=random):
+        self.random = rng  # Breaks ties in argmax
+        self.actions = list(actions)
+        self.action_ids = dict((action, i) for i, action in enumerate(self.actions))
+        self.state_ids = dict()  # Interned state -> row of 'values'
+        self.states = []         # Row -> interned state
+        self.values = np.zeros((capacity, len(self.actions)))
+
+    def __len__(self):
+        return len(self.states)
+
+    def __contains__(self, state):
+        return state in self.state_ids
+
+    def __iter__(self):
+        return iter(self.states)
+
+    def __getitem__(self, state):
+        return QRow(self, self.state_ids[state])
+
+    def __setitem__(self, state, action_values):
+        row = self.add(state)
+        for action, value in action_values.iteritems():
+            self.values[row, self.action_ids[action]] = value
+
+    def add(self, state):
+        """ Interns 'state' with all Q-values set to 0.0 if it is new.
+            Returns the integer id of the state. """
+
+        row = self.state_ids.get(state)
+        if row is None:
+            row = len(self.states)
+            if row == len(self.values): # Double the capacity
+                self.values = np.concatenate((self.values, np.zeros_like(self.values)))
+            self.state_ids[state] = row
+            self.states.append(state)
+        return row
+
+    def clear(self):
+        """ Removes all states, keeping the allocated capacity. """
+
+        self.state_ids = dict()
+        self.states = []
+        self.values[:] = 0.0
+
+    def argmax(self, state):
+        """ Returns the action with the highest Q-value for 'state',
+            choosing randomly between actions that tie. """
+
+        values = self.values[self.state_ids[state]]
+        return self.actions[self.random.choice(np.flatnonzero(values == values.max()))]
+
+    def max(self, state):
+        """ Returns the highest Q-value for 'state'. """
+
+        return self.values[self.state_ids[state]].max()
+
+
+class QBatch(object):
+    """ Collects the Q-learning updates of several agents sharing the Q-table 'Q'
+        and applies them together. Every update of a batch is computed from the
+        Q-values before the batch, and updates of the same state and action add up. """
+
+    def __init__(self, Q):
+        self.Q = Q
+        self.updates = []  # (state, action, reward, alpha)
+
+    def add(self, state, action, reward, alpha):
+        self.updates.append((state, action, reward, alpha))
+
+    def apply(self):
+        """ Applies and clears the collected updates. """
+
+        if not self.updates:
+            return
+
+        if isinstance(self.Q, QTable):
+            states, actions, rewards, alphas = zip(*self.updates)
+            rows = np.array([self.Q.state_ids[state] for state in states])
+            columns = np.array([self.Q.action_ids[action] for action in actions])
+            deltas = np.array(alphas) * (np.array(rewards) - self.Q.values[rows, columns])
+            np.add.at(self.Q.values, (rows, columns), deltas)
+        else:
+            deltas = [alpha * (reward - self.Q[state][action]) for state, action, reward, alpha in self.updates]
+            for (state, action, reward, alpha), delta in zip(self.updates, deltas):
+                self.Q[state][action] += delta
+        self.updates = []
+
+
+class QRow(object):
+    """ View of the Q-values of one state of a QTable, indexed by action. """
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, action):
+        return self.table.values[self.row, self.table.action_ids[action]]
+
+    def __setitem__(self, action, value):
+        self.table.values[self.row, self.table.action_ids[action]] = value
+
+    def __iter__(self):
+        return iter(self.table.actions)
+
+    def keys(self):
+        return list(self.table.actions)
+
+    def values(self):
+        return self.table.values[self.row].tolist()
+
+    def items(self):
+        return zip(self.table.actions, self.values())
+
+    def iteritems(self):
+        return iter(self.items())
@@ -10,6 +10,9 @@ import time
 import random
 import importlib
 import csv
+from metrics import MetricsLog
+from profiler import Profiler
+from checkpoint import save_checkpoint, load_checkpoint
 
 class Simulator(object):
     """Simulates agents in a dynamic smartcab environment.
@@ -34,7 +37,7 @@ class Simulator(object):
         'gray'    : (155, 155, 155)
     }
 
-    def __init__(self, env, size=None, update_delay=2.0, display=True, log_metrics=False, optimized=False):
+    def __init__(self, env, size=None, update_delay=2.0, display=True, log_metrics=False, optimized=False, headless=False, log_name=None, log_format=None, trace_dir=None, profile=False, profile_file=None, incremental_render=True, capture_dir=None, capture_trials=None, capture_format='png', checkpoint_file=None, checkpoint_interval=10, warm_start=None):
         self.env = env
         self.size = size if size is not None else ((self.env.grid_size[0] + 1) * self.env.block_size, (self.env.grid_size[1] + 2) * self.env.block_size)
         self.width, self.height = self.size
@@ -52,7 +55,21 @@ class Simulator(object):
         self.last_updated = 0.0
         self.update_delay = update_delay  # duration between each step (in seconds)
 
-        self.display = display
+        # Headless mode steps trials back-to-back without the GUI or per-step terminal output
+        self.headless = headless
+        self.episodes_per_second = None
+        if self.headless:
+            self.env.quiet = True
+
+        # Capturing frames renders offscreen, through SDL's dummy video driver, as fast as trials can be stepped
+        self.offscreen = capture_dir is not None
+        if self.offscreen:
+            os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+            os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+        self.display = (display and not self.headless) or self.offscreen
+        self.incremental_render = incremental_render  # Only redraw the parts of the screen that changed
+        self.capture = None
         if self.display:
             try:
                 self.pygame = importlib.import_module('pygame')
@@ -68,13 +85,11 @@ class Simulator(object):
                 self.primary_agent_sprite_size = (42, 42)
                 self.agent_circle_radius = 20  # radius of circle, when using simple representation
                 for agent in self.env.agent_states:
-                    if agent.color == 'white':
-                        agent._sprite = self.pygame.transform.smoothscale(self.pygame.image.load(os.path.join("images", "car-{}.png".format(agent.color))), self.primary_agent_sprite_size)
-                    else:
-                        agent._sprite = self.pygame.transform.smoothscale(self.pygame.image.load(os.path.join("images", "car-{}.png".format(agent.color))), self.agent_sprite_size)
-                    agent._sprite_size = (agent._sprite.get_width(), agent._sprite.get_height())
+                    self.load_sprite(agent)
 
-                self.font = self.pygame.font.Font(None, 20)
+                self.fonts = {}  # Font size -> font
+                self.font = self.get_font(20)
+                self.render_static()
                 self.paused = False
             except ImportError as e:
                 self.display = False
@@ -83,6 +98,11 @@ class Simulator(object):
                 self.display = False
                 print "Simulator.__init__(): Error initializing GUI objects; display disabled.\n{}: {}".format(e.__class__.__name__, e)
 
+        # Frames of the selected trials are saved to capture_dir, see capture.py
+        if self.offscreen and self.display:
+            from capture import FrameCapture
+            self.capture = FrameCapture(capture_dir, self.pygame, capture_trials, capture_format)
+
         # Setup metrics to report
         self.log_metrics = log_metrics
         self.optimized = optimized
@@ -92,7 +112,10 @@ class Simulator(object):
 
             # Set log files
             if a.learning:
-                if self.optimized: # Whether the user is optimizing the parameters and decay functions
+                if log_name is not None: # Custom log file name, e.g. for the runs of a parameter sweep
+                    self.log_filename = os.path.join("logs", "{}.csv".format(log_name))
+                    self.table_filename = os.path.join("logs", "{}.txt".format(log_name))
+                elif self.optimized: # Whether the user is optimizing the parameters and decay functions
                     self.log_filename = os.path.join("logs", "sim_improved-learning.csv")
                     self.table_filename = os.path.join("logs","sim_improved-learning.txt")
                 else:
@@ -101,22 +124,57 @@ class Simulator(object):
 
                 self.table_file = open(self.table_filename, 'wb')
             else:
-                self.log_filename = os.path.join("logs", "sim_no-learning.csv")
-
-            self.log_fields = ['trial', 'testing', 'parameters', 'initial_deadline', 'final_deadline', 'net_reward', 'actions', 'success']
-            self.log_file = open(self.log_filename, 'wb')
-            self.log_writer = csv.DictWriter(self.log_file, fieldnames=self.log_fields)
-            self.log_writer.writeheader()
+                self.log_filename = os.path.join("logs", "{}.csv".format(log_name if log_name is not None else "sim_no-learning"))
 
-    def run(self, tolerance=0.05, n_test=0):
+            # Typed columns ('csv' or 'npz') are written through a buffered MetricsLog
+            self.log_format = log_format
+            if self.log_format is not None:
+                self.log_filename = "{}.{}".format(os.path.splitext(self.log_filename)[0], self.log_format)
+                self.metrics_log = MetricsLog(self.log_filename)
+            else:
+                self.log_fields = ['trial', 'testing', 'parameters', 'initial_deadline', 'final_deadline', 'net_reward', 'actions', 'success']
+                self.log_file = open(self.log_filename, 'wb')
+                self.log_writer = csv.DictWriter(self.log_file, fieldnames=self.log_fields)
+                self.log_writer.writeheader()
+
+        # Every step of the primary agent can be recorded for replay, see steptrace.py
+        self.recorder = None
+        if trace_dir is not None:
+            from steptrace import TraceRecorder
+            self.recorder = TraceRecorder(trace_dir, self.env)
+            self.env.recorder = self.recorder
+
+        # The learning state of the primary agent can be saved every 'checkpoint_interval' training
+        # trials and once training is over, and restored from 'warm_start' at the beginning of run
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self.warm_start = warm_start
+
+        # Opt-in timers and counters per phase of the simulation, reported at the end of run
+        self.profiler = Profiler() if profile or profile_file is not None else None
+        self.profile_file = profile_file  # JSON export of the breakdown, if set
+        if self.profiler is not None:
+            self.profiler.attach(self)
+
+    def run(self, tolerance=0.05, n_test=0, max_training=None, testing_only=False):
         """ Run a simulation of the environment.
 
         'tolerance' is the minimum epsilon necessary to begin testing (if enabled)
         'n_test' is the number of testing trials simulated
+        'max_training' is the number of training trials after which testing begins
+        even if epsilon is still above 'tolerance' (default no limit)
+        'testing_only' skips training, e.g. to test an agent warm-started from a checkpoint
+
+        A run warm-started from a checkpoint continues from its trial counters, so
+        a checkpoint written at the end of training starts with the testing trials.
 
-        Note that the minimum number of training trials is always 20. """
+        Note that the minimum number of training trials is always 20.
+        Returns the number of trials simulated per second. """
 
         self.quit = False
+        run_start = time.time()
+        if self.profiler is not None:
+            self.profiler.start()
 
         # Get the primary agent
         a = self.env.primary_agent
@@ -125,130 +183,222 @@ class Simulator(object):
         testing = False
         trial = 1
 
+        if self.warm_start is not None:
+            counters = load_checkpoint(self.warm_start, a)
+            total_trials, testing, trial = counters['total_trials'], counters['testing'], counters['trial']
+        if testing_only and not testing:
+            testing = True
+            trial = 1
+        first_trial = total_trials
+
         while True:
 
             # Flip testing switch
             if not testing:
                 if total_trials > 20: # Must complete minimum 20 training trials
                     if a.learning:
-                        if a.epsilon < tolerance: # assumes epsilon decays to 0
+                        if a.epsilon < tolerance or (max_training is not None and total_trials > max_training): # assumes epsilon decays to 0
                             testing = True
                             trial = 1
                     else:
                         testing = True
                         trial = 1
 
+                    # Save the trained agent, before testing sets its epsilon and alpha to 0
+                    if testing and self.checkpoint_file is not None and a.learning:
+                        save_checkpoint(self.checkpoint_file, a, trial, total_trials, testing)
+
             # Break if we've reached the limit of testing trials
             else:
                 if trial > n_test:
                     break
 
             # Pretty print to terminal
-            print
-            print "/-------------------------"
-            if testing:
-                print "| Testing trial {}".format(trial)
-            else:
-                print "| Training trial {}".format(trial)
+            if not self.headless:
+                print
+                print "/-------------------------"
+                if testing:
+                    print "| Testing trial {}".format(trial)
+                else:
+                    print "| Training trial {}".format(trial)
 
-            print "\-------------------------"
-            print
+                print "\-------------------------"
+                print
 
             self.env.reset(testing)
+            if self.recorder is not None:
+                self.recorder.begin_trial(trial, testing)
             self.current_time = 0.0
             self.last_updated = 0.0
             self.start_time = time.time()
-            while True:
-                try:
-                    # Update current time
-                    self.current_time = time.time() - self.start_time
-
-                    # Handle GUI events
-                    if self.display:
-                        for event in self.pygame.event.get():
-                            if event.type == self.pygame.QUIT:
-                                self.quit = True
-                            elif event.type == self.pygame.KEYDOWN:
-                                if event.key == 27:  # Esc
-                                    self.quit = True
-                                elif event.unicode == u' ':
-                                    self.paused = True
-
-                        if self.paused:
-                            self.pause()
-
-                    # Update environment
-                    if self.current_time - self.last_updated >= self.update_delay:
-                        self.env.step()
-                        self.last_updated = self.current_time
-
-                    # Render text
-                    self.render_text(trial, testing)
-
-                    # Render GUI and sleep
-                    if self.display:
-                        self.render(trial, testing)
-                        self.pygame.time.wait(self.frame_delay)
 
-                except KeyboardInterrupt:
-                    self.quit = True
-                finally:
-                    if self.quit or self.env.done:
-                        break
+            # Step the trial back-to-back when headless or offscreen, otherwise paced by update_delay
+            if self.headless or self.offscreen:
+                if self.capture is not None and self.capture.wants(trial, testing):
+                    self.capture_trial(trial, testing)
+                else:
+                    self.fast_forward()
+            else:
+                while True:
+                    try:
+                        # Update current time
+                        self.current_time = time.time() - self.start_time
+
+                        # Handle GUI events
+                        if self.display:
+                            for event in self.pygame.event.get():
+                                if event.type == self.pygame.QUIT:
+                                    self.quit = True
+                                elif event.type == self.pygame.KEYDOWN:
+                                    if event.key == 27:  # Esc
+                                        self.quit = True
+                                    elif event.unicode == u' ':
+                                        self.paused = True
+
+                            if self.paused:
+                                self.pause()
+
+                        # Update environment
+                        if self.current_time - self.last_updated >= self.update_delay:
+                            self.env.step()
+                            self.last_updated = self.current_time
+
+                        # Render text
+                        self.render_text(trial, testing)
+
+                        # Render GUI and sleep
+                        if self.display:
+                            self.render(trial, testing)
+                            self.pygame.time.wait(self.frame_delay)
+
+                    except KeyboardInterrupt:
+                        self.quit = True
+                    finally:
+                        if self.quit or self.env.done:
+                            break
 
             if self.quit:
                 break
 
+            if self.recorder is not None:
+                self.recorder.end_trial()
+
             # Collect metrics from trial
-            if self.log_metrics:
-                self.log_writer.writerow({
-                    'trial': trial,
-                    'testing': self.env.trial_data['testing'],
-                    'parameters': self.env.trial_data['parameters'],
-                    'initial_deadline': self.env.trial_data['initial_deadline'],
-                    'final_deadline': self.env.trial_data['final_deadline'],
-                    'net_reward': self.env.trial_data['net_reward'],
-                    'actions': self.env.trial_data['actions'],
-                    'success': self.env.trial_data['success']
-                })
+            self.log_trial(trial)
+
+            # Save the learning state, resuming with the next trial
+            if not testing and self.checkpoint_file is not None and a.learning and total_trials % self.checkpoint_interval == 0:
+                save_checkpoint(self.checkpoint_file, a, trial + 1, total_trials + 1)
 
             # Trial finished
-            if self.env.success == True:
-                print "\nTrial Completed!"
-                print "Agent reached the destination."
-            else:
-                print "\nTrial Aborted!"
-                print "Agent did not reach the destination."
+            if not self.headless:
+                if self.env.success == True:
+                    print "\nTrial Completed!"
+                    print "Agent reached the destination."
+                else:
+                    print "\nTrial Aborted!"
+                    print "Agent did not reach the destination."
 
             # Increment
             total_trials = total_trials + 1
             trial = trial + 1
 
+        # Throughput of the simulated trials
+        elapsed = time.time() - run_start
+        self.episodes_per_second = (total_trials - first_trial) / elapsed if elapsed > 0 else float('inf')
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler.add('run', elapsed)
+
         # Clean up
+        if self.recorder is not None:
+            self.recorder.close()
+            self.env.recorder = None
+
         if self.log_metrics:
 
             if a.learning:
                 f = self.table_file
+                encoder = getattr(a, 'state_encoder', None)
 
                 f.write("/-----------------------------------------\n")
                 f.write("| State-action rewards from Q-Learning\n")
                 f.write("\-----------------------------------------\n\n")
 
                 for state in a.Q:
-                    f.write("{}\n".format(state))
+                    f.write("{}\n".format(encoder.decode(state) if encoder is not None else state))
                     for action, reward in a.Q[state].iteritems():
                         f.write(" -- {} : {:.2f}\n".format(action, reward))
                     f.write("\n")
                 self.table_file.close()
 
-            self.log_file.close()
+            if self.log_format is not None:
+                self.metrics_log.close()
+            else:
+                self.log_file.close()
 
         print "\nSimulation ended. . . "
 
         # Report final metrics
+        print "{} trials simulated in {:.2f} seconds ({:.2f} trials/second).".format(total_trials - first_trial, elapsed, self.episodes_per_second)
+        if getattr(a, 'state_encoder', None) is not None:
+            print "State space: {states} states, {visited} visited ({unvisited_fraction:.1%} unvisited), {q_table_bytes} bytes as a full Q-table.".format(**a.state_encoder.statistics())
+        if self.profiler is not None:
+            print self.profiler.report()
+            if self.profile_file is not None:
+                self.profiler.save(self.profile_file)
         if self.display:
             self.pygame.display.quit()  # shut down pygame
 
+        return self.episodes_per_second
+
+    def log_trial(self, trial):
+        """ Writes the metrics of the finished trial to the log, if enabled. """
+
+        if self.log_metrics and self.log_format is not None:
+            self.metrics_log.append(trial, self.env.trial_data)
+        elif self.log_metrics:
+            self.log_writer.writerow({
+                'trial': trial,
+                'testing': self.env.trial_data['testing'],
+                'parameters': self.env.trial_data['parameters'],
+                'initial_deadline': self.env.trial_data['initial_deadline'],
+                'final_deadline': self.env.trial_data['final_deadline'],
+                'net_reward': self.env.trial_data['net_reward'],
+                'actions': self.env.trial_data['actions'],
+                'success': self.env.trial_data['success']
+            })
+
+    def fast_forward(self):
+        """ Steps the environment back-to-back until the current trial is done,
+            without polling the clock, rendering or handling GUI events. """
+
+        try:
+            while not (self.quit or self.env.done):
+                self.env.step()
+        except KeyboardInterrupt:
+            self.quit = True
+
+    def capture_trial(self, trial, testing=False):
+        """ Steps the environment back-to-back until the current trial is done,
+            rendering every step offscreen and saving it as a frame of the capture. """
+
+        self.capture.begin(trial, testing)
+        self._previous_frame = None  # Agents were moved by reset and by uncaptured trials
+        try:
+            self.render(trial, testing)
+            self.capture.add(self.screen)
+            while not (self.quit or self.env.done):
+                self.env.step()
+                if not self.headless:
+                    self.render_text(trial, testing)
+                self.render(trial, testing)
+                self.capture.add(self.screen)
+        except KeyboardInterrupt:
+            self.quit = True
+        finally:
+            self.capture.end()
+
     def render_text(self, trial, testing=False):
         """ This is the non-GUI render display of the simulation.
             Simulated trial data will be rendered in the terminal/command prompt. """
@@ -304,73 +454,187 @@ class Simulator(object):
         """ This is the GUI render display of the simulation.
             Supplementary trial data can be found from render_text. """
 
-        # Reset the screen.
-        self.screen.fill(self.bg_color)
+        if self.incremental_render:
+            self.render_incremental(trial, testing)
+            return
+
+        # Reset the screen to the static elements
+        self.screen.blit(self._background, (0, 0))
 
         # Draw elements
-        # * Static elements
+        # * Traffic lights
+        for intersection, traffic_light in self.env.intersections.iteritems():
+            self.draw_light(intersection, traffic_light)
+
+        # * Dynamic elements
+        for agent, state in self.env.agent_states.iteritems():
+            self.draw_agent(agent, state)
+
+        # * Overlays
+        self.render_overlays(trial, testing)
+
+        # Flip buffers
+        self.pygame.display.flip()
+
+    def render_incremental(self, trial, testing=False):
+        """ Renders like render, but only redraws the rectangles that changed since
+            the previous frame: agents that moved or turned, lights that switched,
+            destinations and the status overlays, starting from the cached background. """
+
+        # Sprites in drawing order, each agent followed by its destination
+        sprites = []
+        for agent, state in self.env.agent_states.iteritems():
+            if not hasattr(agent, '_sprites'): # Created after the simulator
+                self.load_sprite(agent)
+            sprites.append((agent._sprites[state['heading']], self.agent_rect(agent, state)))
+            if state['destination'] is not None:
+                sprites.append((self._logo, self.logo_rect(state['destination'])))
+        sprite_rects = [rect for sprite, rect in sprites]
+        lights = [traffic_light.state for traffic_light in self.env.intersections.itervalues()]
+
+        if self._previous_frame is None: # Draw everything
+            dirty = [self.screen.get_rect()]
+        else:
+            previous_sprites, previous_lights = self._previous_frame
+            dirty = [self.overlay_rect]
+            if len(previous_sprites) == len(sprites):
+                for (sprite, rect), (previous_sprite, previous_rect) in zip(sprites, previous_sprites):
+                    if sprite is not previous_sprite or rect != previous_rect:
+                        dirty.append(previous_rect)
+                        dirty.append(rect)
+            else:
+                dirty.extend(rect for sprite, rect in previous_sprites + sprites)
+            for i, (state, previous_state) in enumerate(zip(lights, previous_lights)):
+                if state != previous_state:
+                    dirty.append(self.light_rects[i])
+        self._previous_frame = (sprites, lights)
+
+        # Restore the background of each dirty rectangle and redraw what overlaps it
+        intersections = self.env.intersections.items()
+        for rect in dirty:
+            self.screen.set_clip(rect)
+            self.screen.blit(self._background, rect, rect)
+            for i in rect.collidelistall(self.light_rects):
+                self.draw_light(*intersections[i])
+            for i in rect.collidelistall(sprite_rects):
+                self.screen.blit(*sprites[i])
+        self.screen.set_clip(None)
+
+        self.render_overlays(trial, testing)
+        self.pygame.display.update(dirty)
+
+    def render_static(self):
+        """ Draws the elements that do not change during a simulation (background,
+            boundary, roads and intersections) once, into a cached surface. """
+
+        self._background = self.pygame.Surface(self.size).convert()
+        self._background.fill(self.bg_color)
 
         # Boundary
-        self.pygame.draw.rect(self.screen, self.boundary, ((self.env.bounds[0] - self.env.hang)*self.env.block_size, (self.env.bounds[1]-self.env.hang)*self.env.block_size, (self.env.bounds[2] + self.env.hang/3)*self.env.block_size, (self.env.bounds[3] - 1 + self.env.hang/3)*self.env.block_size), 4)
+        self.pygame.draw.rect(self._background, self.boundary, ((self.env.bounds[0] - self.env.hang)*self.env.block_size, (self.env.bounds[1]-self.env.hang)*self.env.block_size, (self.env.bounds[2] + self.env.hang/3)*self.env.block_size, (self.env.bounds[3] - 1 + self.env.hang/3)*self.env.block_size), 4)
 
-        for road in self.env.roads:
+        for road in self.env.road_segments:
             # Road
-            self.pygame.draw.line(self.screen, self.road_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), self.road_width)
+            self.pygame.draw.line(self._background, self.road_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), self.road_width)
             # Center line
-            self.pygame.draw.line(self.screen, self.line_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), 2)
+            self.pygame.draw.line(self._background, self.line_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), 2)
+
+        for intersection in self.env.intersections:
+            self.pygame.draw.circle(self._background, self.road_color, (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size), self.road_width/2)
+
+        # Traffic lights with their stop lines, drawn once for each state
+        self.light_center = self.road_width/2 + 4  # Center of the intersection on a traffic light surface
+        c = self.light_center
+        self._lights = {}
+        for state in (True, False):
+            light = self.pygame.Surface((2 * c + 1, 2 * c + 1), self.pygame.SRCALPHA).convert_alpha()
+            if state: # North-South is open
+                light.blit(self._ns, (c - self.road_width/2, c - self.road_width/2))
+                self.pygame.draw.line(light, self.stop_color, (c - self.road_width/2, c - self.road_width/2), (c - self.road_width/2, c + self.road_width/2), 2)
+                self.pygame.draw.line(light, self.stop_color, (c + self.road_width/2 + 1, c - self.road_width/2), (c + self.road_width/2 + 1, c + self.road_width/2), 2)
+            else:
+                light.blit(self._ew, (c - self.road_width/2, c - self.road_width/2))
+                self.pygame.draw.line(light, self.stop_color, (c - self.road_width/2, c - self.road_width/2), (c + self.road_width/2, c - self.road_width/2), 2)
+                self.pygame.draw.line(light, self.stop_color, (c + self.road_width/2, c + self.road_width/2 + 1), (c - self.road_width/2, c + self.road_width/2 + 1), 2)
+            self._lights[state] = light
+
+        # Screen rectangles of the traffic lights and the status text
+        self.light_rects = [self.pygame.rect.Rect(x * self.env.block_size - c, y * self.env.block_size - c, 2 * c + 1, 2 * c + 1)
+                            for x, y in self.env.intersections]
+        self.overlay_rect = self.pygame.rect.Rect(0, 0, self.width, 130)
+        self._previous_frame = None
+
+    def load_sprite(self, agent):
+        """ Loads the sprite of 'agent', rotated once for every heading. """
+
+        if agent.color == 'white':
+            agent._sprite = self.pygame.transform.smoothscale(self.pygame.image.load(os.path.join("images", "car-{}.png".format(agent.color))), self.primary_agent_sprite_size)
+        else:
+            agent._sprite = self.pygame.transform.smoothscale(self.pygame.image.load(os.path.join("images", "car-{}.png".format(agent.color))), self.agent_sprite_size)
+        agent._sprite_size = (agent._sprite.get_width(), agent._sprite.get_height())
+        agent._sprites = dict((heading, agent._sprite if heading == (1, 0) else self.pygame.transform.rotate(agent._sprite, 180 if heading[0] == -1 else heading[1] * -90))
+                              for heading in self.env.valid_headings)
 
-        for intersection, traffic_light in self.env.intersections.iteritems():
-            self.pygame.draw.circle(self.screen, self.road_color, (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size), self.road_width/2)
+    def get_font(self, size):
+        """ Returns the default font of 'size', loaded once. """
 
-            if traffic_light.state: # North-South is open
-                self.screen.blit(self._ns,
-                    self.pygame.rect.Rect(intersection[0]*self.env.block_size - self.road_width/2, intersection[1]*self.env.block_size - self.road_width/2, intersection[0]*self.env.block_size + self.road_width, intersection[1]*self.env.block_size + self.road_width/2))
-                self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2), 2)
-                self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size + self.road_width/2 + 1, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size + self.road_width/2 + 1, intersection[1] * self.env.block_size + self.road_width/2), 2)
-            else:
-                self.screen.blit(self._ew,
-                    self.pygame.rect.Rect(intersection[0]*self.env.block_size - self.road_width/2, intersection[1]*self.env.block_size - self.road_width/2, intersection[0]*self.env.block_size + self.road_width, intersection[1]*self.env.block_size + self.road_width/2))
-                self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size + self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), 2)
-                self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size + self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2 + 1), (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2 + 1), 2)
+        if size not in self.fonts:
+            self.fonts[size] = self.pygame.font.Font(None, size)
+        return self.fonts[size]
 
-        # * Dynamic elements
-        self.font = self.pygame.font.Font(None, 20)
-        for agent, state in self.env.agent_states.iteritems():
-            # Compute precise agent location here (back from the intersection some)
-            agent_offset = (2 * state['heading'][0] * self.agent_circle_radius + self.agent_circle_radius * state['heading'][1] * 0.5, \
-                            2 * state['heading'][1] * self.agent_circle_radius - self.agent_circle_radius * state['heading'][0] * 0.5)
+    def draw_light(self, intersection, traffic_light):
+        """ Draws the traffic light of 'intersection' and its stop lines. """
 
+        self.screen.blit(self._lights[traffic_light.state],
+            (intersection[0] * self.env.block_size - self.light_center, intersection[1] * self.env.block_size - self.light_center))
 
-            agent_pos = (state['location'][0] * self.env.block_size - agent_offset[0], state['location'][1] * self.env.block_size - agent_offset[1])
-            agent_color = self.colors[agent.color]
+    def agent_position(self, state):
+        """ Returns the screen position of an agent, back from the intersection some. """
 
-            if hasattr(agent, '_sprite') and agent._sprite is not None:
-                # Draw agent sprite (image), properly rotated
-                rotated_sprite = agent._sprite if state['heading'] == (1, 0) else self.pygame.transform.rotate(agent._sprite, 180 if state['heading'][0] == -1 else state['heading'][1] * -90)
-                self.screen.blit(rotated_sprite,
-                    self.pygame.rect.Rect(agent_pos[0] - agent._sprite_size[0] / 2, agent_pos[1] - agent._sprite_size[1] / 2,
-                        agent._sprite_size[0], agent._sprite_size[1]))
-            else:
-                # Draw simple agent (circle with a short line segment poking out to indicate heading)
-                self.pygame.draw.circle(self.screen, agent_color, agent_pos, self.agent_circle_radius)
-                self.pygame.draw.line(self.screen, agent_color, agent_pos, state['location'], self.road_width)
+        agent_offset = (2 * state['heading'][0] * self.agent_circle_radius + self.agent_circle_radius * state['heading'][1] * 0.5, \
+                        2 * state['heading'][1] * self.agent_circle_radius - self.agent_circle_radius * state['heading'][0] * 0.5)
+        return (state['location'][0] * self.env.block_size - agent_offset[0], state['location'][1] * self.env.block_size - agent_offset[1])
 
+    def agent_rect(self, agent, state):
+        """ Returns the screen rectangle of the sprite of 'agent'. """
 
-            if state['destination'] is not None:
-                self.screen.blit(self._logo,
-                    self.pygame.rect.Rect(state['destination'][0] * self.env.block_size - self.road_width/2, \
-                        state['destination'][1]*self.env.block_size - self.road_width/2, \
-                        state['destination'][0]*self.env.block_size + self.road_width/2, \
-                        state['destination'][1]*self.env.block_size + self.road_width/2))
+        agent_pos = self.agent_position(state)
+        return self.pygame.rect.Rect(agent_pos[0] - agent._sprite_size[0] / 2, agent_pos[1] - agent._sprite_size[1] / 2,
+            agent._sprite_size[0], agent._sprite_size[1])
 
-        # * Overlays
-        self.font = self.pygame.font.Font(None, 50)
+    def logo_rect(self, destination):
+        """ Returns the screen rectangle of the logo marking 'destination'. """
+
+        return self.pygame.rect.Rect(destination[0] * self.env.block_size - self.road_width/2, destination[1] * self.env.block_size - self.road_width/2,
+            self.road_width, self.road_width)
+
+    def draw_agent(self, agent, state):
+        """ Draws 'agent' and, if it has one, its destination. """
+
+        if hasattr(agent, '_sprite') and agent._sprite is not None:
+            # Draw agent sprite (image), properly rotated
+            self.screen.blit(agent._sprites[state['heading']], self.agent_rect(agent, state))
+        else:
+            # Draw simple agent (circle with a short line segment poking out to indicate heading)
+            agent_pos = self.agent_position(state)
+            agent_color = self.colors[agent.color]
+            self.pygame.draw.circle(self.screen, agent_color, agent_pos, self.agent_circle_radius)
+            self.pygame.draw.line(self.screen, agent_color, agent_pos, state['location'], self.road_width)
+
+        if state['destination'] is not None:
+            self.screen.blit(self._logo, self.logo_rect(state['destination']))
+
+    def render_overlays(self, trial, testing=False):
+        """ Draws the trial number and the status text of the primary agent's last step. """
+
+        state = self.env.agent_states[self.env.primary_agent]
+        self.font = self.get_font(50)
         if testing:
             self.screen.blit(self.font.render("Testing Trial %s"%(trial), True, self.colors['black'], self.bg_color), (10, 10))
         else:
             self.screen.blit(self.font.render("Training Trial %s"%(trial), True, self.colors['black'], self.bg_color), (10, 10))
 
-        self.font = self.pygame.font.Font(None, 30)
+        self.font = self.get_font(30)
 
         # Status text about each step
         status = self.env.step_data
@@ -424,32 +688,28 @@ class Simulator(object):
 
             # Denote whether a trial was a success or failure
             if (state['destination'] != state['location'] and state['deadline'] > 0) or (self.env.enforce_deadline is not True and state['destination'] != state['location']):
-                self.font = self.pygame.font.Font(None, 40)
+                self.font = self.get_font(40)
                 if self.env.success == True:
                     self.screen.blit(self.font.render("Previous Trial: Success", True, self.colors['dgreen'], self.bg_color), (10, 50))
                 if self.env.success == False:
                     self.screen.blit(self.font.render("Previous Trial: Failure", True, self.colors['maroon'], self.bg_color), (10, 50))
 
                 if self.env.primary_agent.learning:
-                    self.font = self.pygame.font.Font(None, 22)
+                    self.font = self.get_font(22)
                     self.screen.blit(self.font.render("epsilon = {:.4f}".format(self.env.primary_agent.epsilon), True, self.colors['black'], self.bg_color), (10, 80))
                     self.screen.blit(self.font.render("alpha = {:.4f}".format(self.env.primary_agent.alpha), True, self.colors['black'], self.bg_color), (10, 95))
 
         # Reset status text
         else:
             self.pygame.rect.Rect(350, 10, self.width, 200)
-            self.font = self.pygame.font.Font(None, 40)
+            self.font = self.get_font(40)
             self.screen.blit(self.font.render("Simulating trial. . .", True, self.colors['white'], self.bg_color), (400, 60))
 
-
-        # Flip buffers
-        self.pygame.display.flip()
-
     def pause(self):
         """ When the GUI is enabled, this function will pause the simulation. """
 
         abs_pause_time = time.time()
-        self.font = self.pygame.font.Font(None, 30)
+        self.font = self.get_font(30)
         pause_text = "Simulation Paused. Press any key to continue. . ."
         self.screen.blit(self.font.render(pause_text, True, self.colors['red'], self.bg_color), (400, self.height - 30))
         self.pygame.display.flip()
@@ -460,4 +720,5 @@ class Simulator(object):
                     self.paused = False
             self.pygame.time.wait(self.frame_delay)
         self.screen.blit(self.font.render(pause_text, True, self.bg_color, self.bg_color), (400, self.height - 30))
+        self._previous_frame = None  # Redraw the whole screen
         self.start_time += (time.time() - abs_pause_time)
@@ -0,0 +1,299 @@
+import os
+import sys
+import csv
+import json
+import ast
+import numpy as np
+
+from environment import Environment, Agent
+from simulator import Simulator
+from metrics import MetricsLog
+
+# Columns of the trial index of a trace
+index_fields = ['trial', 'testing', 'steps', 'file', 'start_x', 'start_y', 'start_heading',
+                'destination_x', 'destination_y', 'initial_deadline', 'epsilon', 'alpha']
+
+# Order of the action and heading codes of a trace
+valid_actions = Environment.valid_actions
+valid_headings = Environment.valid_headings
+
+
+def step_dtype(num_intersections):
+    """ Returns the record of one step of the primary agent. 'lights' packs the
+        state of every traffic light (True = NS open) in intersection order. """
+
+    return np.dtype([
+        ('t', np.int32),
+        ('state', np.int32),        # Interned id of the agent's state
+        ('action', np.int8),        # Index into valid_actions
+        ('reward', np.float64),
+        ('violation', np.int8),     # 0: Action okay ... 4: Major accident, see Environment.act
+        ('deadline', np.int32),     # Deadline when the action was taken
+        ('x', np.int16),            # Location and heading after the action
+        ('y', np.int16),
+        ('heading', np.int8),       # Index into valid_headings
+        ('waypoint', np.int8),      # Index into valid_actions
+        ('light', np.bool_),        # If the agent's light was green
+        ('lights', np.uint8, ((num_intersections + 7) // 8,))
+    ])
+
+
+class TraceRecorder(object):
+    """ Records every step of the primary agent into a preallocated ring buffer
+        and writes one raw, memory-mappable file of step records per trial.
+
+        The buffer is written whenever it fills up and at the end of each trial,
+        so traces of any length cost at most 'capacity' steps of memory. The
+        directory also holds 'index.csv', one row per trial, and 'trace.json'
+        with the grid size and the table of interned states. """
+
+    def __init__(self, directory, env, capacity=1024):
+        self.directory = directory
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        self.env = env
+        self.lights = list(env.intersections.itervalues())
+        self.dtype = step_dtype(len(self.lights))
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=self.dtype)
+        self.size = 0           # Steps of the current trial in the buffer
+        self.steps = 0          # Steps of the current trial in total
+        self.file = None        # Step file of the current trial
+
+        self.state_ids = {}     # Interned state -> id
+        self.states = []        # Id -> interned state
+        self.entry = None       # Index row of the current trial
+
+        self.index_file = open(os.path.join(self.directory, "index.csv"), 'wb')
+        self.index_writer = csv.DictWriter(self.index_file, fieldnames=index_fields)
+        self.index_writer.writeheader()
+
+    def begin_trial(self, trial, testing):
+        """ Starts the trace of a trial, called after Environment.reset. """
+
+        agent = self.env.primary_agent
+        state = self.env.agent_states[agent]
+        self.size = 0
+        self.steps = 0
+        self.entry = {
+            'trial': trial,
+            'testing': testing,
+            'file': "{}-{:04d}.steps".format('testing' if testing else 'training', trial),
+            'start_x': state['location'][0],
+            'start_y': state['location'][1],
+            'start_heading': valid_headings.index(state['heading']),
+            'destination_x': state['destination'][0],
+            'destination_y': state['destination'][1],
+            'initial_deadline': state['deadline'],
+            'epsilon': getattr(agent, 'epsilon', None),
+            'alpha': getattr(agent, 'alpha', None)
+        }
+
+    def record(self, agent):
+        """ Appends the step just taken by the primary agent, from Environment.step_data. """
+
+        if self.size == self.capacity:
+            self.write()
+
+        status = self.env.step_data
+        state = self.env.agent_states[agent]
+
+        state_id = self.state_ids.get(status['state'])
+        if state_id is None:
+            state_id = self.state_ids[status['state']] = len(self.states)
+            self.states.append(status['state'])
+
+        self.buffer[self.size] = (status['t'], state_id, valid_actions.index(status['action']), status['reward'],
+                                  status['violation'], status['deadline'], state['location'][0], state['location'][1],
+                                  valid_headings.index(state['heading']), valid_actions.index(status['waypoint']),
+                                  status['light'] == 'green', np.packbits([light.state for light in self.lights]))
+        self.size += 1
+        self.steps += 1
+
+    def write(self):
+        """ Appends the buffered steps to the step file of the current trial. """
+
+        if self.file is None:
+            self.file = open(os.path.join(self.directory, self.entry['file']), 'wb')
+        self.buffer[:self.size].tofile(self.file)
+        self.size = 0
+
+    def end_trial(self):
+        """ Writes the remaining steps and the index row of a finished trial. """
+
+        self.write()
+        self.file.close()
+        self.file = None
+
+        self.entry['steps'] = self.steps
+        self.index_writer.writerow(self.entry)
+        self.index_file.flush()
+        self.entry = None
+
+    def close(self):
+        """ Closes the trace, dropping the steps of an unfinished trial. """
+
+        if self.file is not None:
+            self.file.close()
+        self.index_file.close()
+
+        with open(os.path.join(self.directory, "trace.json"), 'wb') as f:
+            json.dump({
+                'grid_size': list(self.env.grid_size),
+                'enforce_deadline': self.env.enforce_deadline,
+                'states': [repr(state) for state in self.states]
+            }, f)
+
+
+class StepTrace(object):
+    """ Reads a trace written by TraceRecorder. The steps of each trial are
+        memory-mapped, so they are read from disk only as they are accessed. """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        with open(os.path.join(self.directory, "trace.json"), 'rb') as f:
+            header = json.load(f)
+        self.grid_size = tuple(header['grid_size'])
+        self.enforce_deadline = header['enforce_deadline']
+        self.states = [ast.literal_eval(state) for state in header['states']]
+        self.dtype = step_dtype(self.grid_size[0] * self.grid_size[1])
+
+        self.index = []
+        with open(os.path.join(self.directory, "index.csv"), 'rb') as f:
+            for row in csv.DictReader(f):
+                for field in ['trial', 'steps', 'start_x', 'start_y', 'start_heading', 'destination_x', 'destination_y', 'initial_deadline']:
+                    row[field] = int(row[field])
+                for field in ['epsilon', 'alpha']:
+                    row[field] = float(row[field]) if row[field] else None
+                row['testing'] = row['testing'] == 'True'
+                self.index.append(row)
+
+    def __len__(self):
+        return len(self.index)
+
+    def steps(self, i):
+        """ Returns the step records of the i-th trial of the trace. """
+
+        entry = self.index[i]
+        if entry['steps'] == 0:
+            return np.zeros(0, dtype=self.dtype)
+        return np.memmap(os.path.join(self.directory, entry['file']), dtype=self.dtype, mode='r', shape=(entry['steps'],))
+
+    def lights(self, steps):
+        """ Returns the traffic light states of 'steps' as a (steps, intersections) bool array. """
+
+        return np.unpackbits(steps['lights'], axis=1)[:, :self.grid_size[0] * self.grid_size[1]].astype(bool)
+
+    def trial_data(self, i):
+        """ Recomputes the metrics Environment collects in 'trial_data' for the i-th trial. """
+
+        entry = self.index[i]
+        steps = self.steps(i)
+        violations = np.bincount(steps['violation'], minlength=5)
+
+        success = 0
+        if len(steps) > 0:
+            last = steps[-1]
+            if (last['x'], last['y']) == (entry['destination_x'], entry['destination_y']) and last['deadline'] >= 0:
+                success = 1
+
+        return {
+            'testing': entry['testing'],
+            'parameters': {'e': entry['epsilon'], 'a': entry['alpha']},
+            'initial_deadline': entry['initial_deadline'],
+            'final_deadline': int(steps['deadline'][-1]) - 1 if len(steps) > 0 else entry['initial_deadline'],
+            'net_reward': steps['reward'].sum(),
+            'actions': dict((violation, int(violations[violation])) for violation in xrange(5)),
+            'success': success
+        }
+
+    def write_metrics(self, filename):
+        """ Writes the recomputed metrics of every trial to a typed-column MetricsLog. """
+
+        log = MetricsLog(filename)
+        for i, entry in enumerate(self.index):
+            log.append(entry['trial'], self.trial_data(i))
+        log.close()
+
+    def replay(self, update_delay=0.5, display=True, trials=None):
+        """ Re-renders the primary agent of the given trials (default all) without
+            simulating the environment. Dummy agents are not part of a trace.
+            Falls back to the terminal output if pygame is not available. """
+
+        env = Environment(num_dummies=0, grid_size=self.grid_size)
+        env.quiet = True
+        agent = env.create_agent(Agent)
+        agent.learning = False
+        env.set_primary_agent(agent, enforce_deadline=self.enforce_deadline)
+        sim = Simulator(env, update_delay=update_delay, display=display)
+        lights = list(env.intersections.itervalues())
+
+        for i in (trials if trials is not None else xrange(len(self))):
+            entry = self.index[i]
+            steps = self.steps(i)
+            light_states = self.lights(steps)
+
+            agent.learning = entry['epsilon'] is not None
+            agent.epsilon = entry['epsilon']
+            agent.alpha = entry['alpha']
+            env.agent_states[agent] = {
+                'location': (entry['start_x'], entry['start_y']),
+                'heading': valid_headings[entry['start_heading']],
+                'destination': (entry['destination_x'], entry['destination_y']),
+                'deadline': entry['initial_deadline']
+            }
+            env.step_data = {}
+            env.success = None
+
+            for j in xrange(len(steps) + 1):
+                if j > 0:
+                    step = steps[j - 1]
+                    for light, state in zip(lights, light_states[j - 1]):
+                        light.state = state
+                    env.agent_states[agent].update({
+                        'location': (int(step['x']), int(step['y'])),
+                        'heading': valid_headings[step['heading']],
+                        'deadline': int(step['deadline']) - 1
+                    })
+                    env.step_data = {
+                        't': int(step['t']),
+                        'violation': int(step['violation']),
+                        'state': self.states[step['state']],
+                        'deadline': int(step['deadline']),
+                        'waypoint': valid_actions[step['waypoint']],
+                        'inputs': None,
+                        'light': 'green' if step['light'] else 'red',
+                        'action': valid_actions[step['action']],
+                        'reward': float(step['reward'])
+                    }
+
+                if sim.display:
+                    sim.render(entry['trial'], entry['testing'])
+                    sim.pygame.time.wait(sim.frame_delay)
+                    if any(event.type == sim.pygame.QUIT for event in sim.pygame.event.get()):
+                        sim.pygame.display.quit()
+                        return
+                else:
+                    sim.render_text(entry['trial'], entry['testing'])
+
+            env.success = self.trial_data(i)['success'] == 1
+
+        if sim.display:
+            sim.pygame.display.quit()
+
+
+def main(args):
+    """ Replays a trace, 'python -m smartcab.steptrace logs/trace', or writes its
+        recomputed metrics, 'python -m smartcab.steptrace logs/trace logs/trace.csv'. """
+
+    trace = StepTrace(args[0])
+    if len(args) > 1:
+        trace.write_metrics(args[1])
+    else:
+        trace.replay()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,131 @@
+import os
+import random
+import itertools
+import multiprocessing
+import pandas as pd
+
+from environment import Environment
+from agent import LearningAgent
+from simulator import Simulator
+
+# Hyper-parameters that can be swept, with the values used by agent.run
+parameter_defaults = {
+    'epsilon': 1.0,
+    'epsilon_step': 0.0,
+    'alpha': 0.0075,
+    'tolerance': 0.07,
+    'use_input_right': False,
+    'decay_function': 4
+}
+
+# Ratings of smartcab/visuals.py, from worst to best
+ratings = ['F', 'D', 'C', 'B', 'A', 'A+']
+
+
+def parameter_grid(**values):
+    """ Returns every combination of the given lists of parameter values,
+        e.g. parameter_grid(alpha=[0.01, 0.1], decay_function=[1, 3]). """
+
+    names = sorted(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*[values[name] for name in names])]
+
+
+def parameter_sample(n, seed=None, **space):
+    """ Returns 'n' random parameter combinations. Each parameter is drawn from
+        a list of values, or uniformly from a (low, high) tuple. """
+
+    rng = random.Random(seed)
+    sample = []
+    for i in xrange(n):
+        parameters = {}
+        for name in sorted(space):
+            values = space[name]
+            parameters[name] = rng.uniform(*values) if isinstance(values, tuple) else rng.choice(values)
+        sample.append(parameters)
+    return sample
+
+
+def run_simulation(run):
+    """ Runs and rates one simulation of a sweep in headless mode. 'run' holds the
+        'parameters' to override, the 'seed', the 'log_name' and 'log_format' of the
+        Simulator and the 'n_test' and 'max_training' arguments of Simulator.run. """
+
+    import visuals # Requires the top-level project directory on the path
+
+    parameters = dict(parameter_defaults, **run['parameters'])
+
+    env = Environment(seed=run['seed']) # Master seed of all random streams of the run
+    agent = env.create_agent(LearningAgent, learning=True, epsilon=parameters['epsilon'], alpha=parameters['alpha'],
+                             decay_function=parameters['decay_function'], epsilon_step=parameters['epsilon_step'], use_input_right=parameters['use_input_right'])
+    env.set_primary_agent(agent, enforce_deadline=True)
+
+    sim = Simulator(env, update_delay=0.0, log_metrics=True, display=False, headless=True, log_name=run['log_name'], log_format=run['log_format'])
+    episodes_per_second = sim.run(n_test=run['n_test'], tolerance=parameters['tolerance'], max_training=run['max_training'])
+
+    result = dict(parameters)
+    result['seed'] = run['seed']
+    result['log_file'] = sim.log_filename
+    result['episodes_per_second'] = episodes_per_second
+    result.update(visuals.rate_trials(sim.log_filename))
+    return result
+
+
+def sweep(parameters, n_test=10, max_training=None, processes=None, seed=0, name='sweep', log_format='csv'):
+    """ Runs one simulation per parameter combination over a process pool and returns
+        their ratings as a DataFrame, ranked from best to worst.
+
+        'parameters' is a list of dicts, e.g. from parameter_grid or parameter_sample
+        'n_test' is the number of testing trials of every simulation
+        'max_training' is the maximum number of training trials of every simulation
+        'processes' is the size of the pool, default is the number of cores
+        'seed' is the seed of the first run, the following runs count up from it
+        'name' prefixes the log files: logs/sim_<name>-<run>.<log_format> and the
+        ranked table logs/sim_<name>-results.csv
+        'log_format' is the MetricsLog format of the runs, 'csv' or 'npz' """
+
+    runs = [{
+        'parameters': p,
+        'seed': seed + i,
+        'log_name': "sim_{}-{:03d}".format(name, i),
+        'log_format': log_format,
+        'n_test': n_test,
+        'max_training': max_training
+    } for i, p in enumerate(parameters)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pd.DataFrame(pool.map(run_simulation, runs))
+    finally:
+        pool.close()
+        pool.join()
+
+    # Rank by both ratings, then by reliability
+    results['safety_score'] = results['safety'].map(lambda x: ratings.index(x) if x in ratings else -1)
+    results['reliability_score'] = results['reliability'].map(lambda x: ratings.index(x) if x in ratings else -1)
+    results['score'] = results['safety_score'] + results['reliability_score']
+    results = results.sort_values(['score', 'reliability_score', 'safety_score'], ascending=False).reset_index(drop=True)
+
+    results.to_csv(os.path.join("logs", "sim_{}-results.csv".format(name)), index=False)
+    return results
+
+
+def run():
+    """ Driving function for a parameter sweep, run from the top-level project
+        directory with 'python -m smartcab.sweep'. """
+
+    # #################
+    # swept hyper parameters:
+    # #################
+    parameters = parameter_grid(
+        alpha=[0.005, 0.0075, 0.01, 0.05],
+        decay_function=[1, 3, 4, 5],
+        use_input_right=[False, True]
+    )
+
+    results = sweep(parameters, n_test=10, max_training=1000)
+
+    print results[['safety', 'reliability'] + sorted(parameter_defaults) + ['training_trials', 'log_file']].to_string()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,567 @@
+import os
+import csv
+import time
+import numpy as np
+from environment import Environment, derive_seed
+from planner import waypoint_table
+
+# Integer codes used by the vectorized engine.
+# Actions, waypoints and sensed traffic index Environment.valid_actions: None, 'forward', 'left', 'right'
+NONE, FORWARD, LEFT, RIGHT = range(len(Environment.valid_actions))
+
+# Headings index Environment.valid_headings: E, N, W, S
+# A left turn is one step forward in that list and a right turn one step back.
+HEADINGS = np.array(Environment.valid_headings)
+
+# Reward added for each violation class (see Environment.act)
+VIOLATION_REWARDS = np.array([0.0, -5.0, -10.0, -20.0, -40.0])
+
+
+class VectorEnvironment(object):
+    """ Many independent smartcab worlds, stepped in lockstep with NumPy arrays.
+
+        Every world follows the traffic rules and reward scheme of Environment and
+        has its own traffic lights, dummy agents and primary agent. Agents are arrays
+        instead of objects: locations are 0-based (column, row) pairs, headings index
+        Environment.valid_headings, and actions, waypoints and sensed inputs index
+        Environment.valid_actions.
+
+        Dummy agents sense and move synchronously from the positions at the start
+        of a step, rather than one after another as in Environment. """
+
+    valid_actions = Environment.valid_actions
+    valid_headings = Environment.valid_headings
+    hard_time_limit = Environment.hard_time_limit
+
+    def __init__(self, num_worlds=100, verbose=False, num_dummies=100, grid_size=(8, 6), seed=None):
+        self.num_worlds = num_worlds  # Number of independent worlds
+        self.num_dummies = num_dummies  # Number of dummy driver agents in each world
+        self.verbose = verbose # If debug output should be given
+        self.seed = seed  # Master seed of the random streams
+        self.random = self.random_stream('placement')
+
+        # Road network
+        self.grid_size = grid_size  # (columns, rows)
+        self.num_intersections = grid_size[0] * grid_size[1]
+        self.waypoint_table = waypoint_table(grid_size, self.valid_headings, self.valid_actions)
+        assert num_dummies <= len(self.valid_headings) * self.num_intersections, "Too many dummy agents for the grid!"
+
+        shape = (num_worlds, self.num_intersections)
+
+        # Traffic lights (True = NS open; False = EW open), see TrafficLight
+        self.light_state = self.random.rand(*shape) < 0.5
+        self.light_period = self.random.randint(2, 6, size=shape)
+        self.light_updated = np.zeros(shape, dtype=int)
+
+        # Dummy agents
+        self.dummy_location = np.zeros((num_worlds, num_dummies, 2), dtype=int)
+        self.dummy_heading = np.zeros((num_worlds, num_dummies), dtype=int)
+        self.dummy_waypoint = self.random.randint(FORWARD, RIGHT + 1, size=(num_worlds, num_dummies))
+        self._dummy_world = np.repeat(np.arange(num_worlds), num_dummies)  # World of each dummy, flattened
+        self._slot_inputs = None  # Traffic seen from each (intersection, heading) slot, computed lazily
+
+        # Primary agent and associated parameters
+        self.primary_agent = None  # to be set explicitly
+        self.enforce_deadline = False
+        self.location = np.zeros((num_worlds, 2), dtype=int)
+        self.heading = np.zeros(num_worlds, dtype=int)
+        self.destination = np.zeros((num_worlds, 2), dtype=int)
+        self.deadline = np.zeros(num_worlds, dtype=int)
+
+        # Simulation variables (worlds are done until they are reset)
+        self.t = np.zeros(num_worlds, dtype=int)
+        self.done = np.ones(num_worlds, dtype=bool)
+        self.success = np.zeros(num_worlds, dtype=bool)
+
+        # Trial data (updated at the end of each trial)
+        self.trial_data = {
+            'testing': np.zeros(num_worlds, dtype=bool),
+            'initial_distance': np.zeros(num_worlds, dtype=int),
+            'initial_deadline': np.zeros(num_worlds, dtype=int),
+            'net_reward': np.zeros(num_worlds),
+            'final_deadline': np.zeros(num_worlds, dtype=int),
+            'actions': np.zeros((num_worlds, len(VIOLATION_REWARDS)), dtype=int),
+            'parameters': {'e': np.zeros(num_worlds), 'a': np.zeros(num_worlds)},
+            'success': np.zeros(num_worlds, dtype=int)
+        }
+
+    def set_primary_agent(self, agent, enforce_deadline=False):
+        """ Sets 'agent' as the primary agent of every world. """
+
+        self.primary_agent = agent
+        self.enforce_deadline = enforce_deadline
+
+    def random_stream(self, *names):
+        """ Returns a new random generator for the stream identified by 'names'. """
+
+        seed = derive_seed(self.seed, *names)
+        return np.random.RandomState(None if seed is None else seed % 2**32)
+
+    def reset(self, testing=False, worlds=None):
+        """ Begins a new trial in 'worlds' (a boolean mask or indices, default all).
+            'testing' is a flag for all worlds or a boolean array over all worlds. """
+
+        index = self._world_index(worlds)
+        n = len(index)
+        testing = np.broadcast_to(np.asarray(testing, dtype=bool), (self.num_worlds,))[index]
+
+        self.done[index] = False
+        self.success[index] = False
+        self.t[index] = 0
+
+        # Reset traffic lights
+        self.light_updated[index] = 0
+
+        # Pick a start and a destination that are not too close
+        start = self.random_locations(n)
+        destination = self.random_locations(n)
+        close = self.compute_dist(start, destination) < 4
+        while close.any():
+            start[close] = self.random_locations(close.sum())
+            destination[close] = self.random_locations(close.sum())
+            close = self.compute_dist(start, destination) < 4
+
+        distance = self.compute_dist(start, destination)
+        deadline = distance * 5 # 5 time steps per intersection away
+        self.location[index] = start
+        self.heading[index] = self.random.randint(len(self.valid_headings), size=n)
+        self.destination[index] = destination
+        self.deadline[index] = deadline
+
+        # Dummy agents take distinct (intersection, heading) slots
+        num_slots = len(self.valid_headings) * self.num_intersections
+        slots = np.argsort(self.random.rand(n, num_slots), axis=1)[:, :self.num_dummies]
+        self.dummy_location[index] = self.intersection_location(slots // len(self.valid_headings))
+        self.dummy_heading[index] = slots % len(self.valid_headings)
+        self._slot_inputs = None
+
+        if self.verbose: # Debugging
+            print "VectorEnvironment.reset(): Trial set up in {} worlds".format(n)
+
+        if self.primary_agent is not None:
+            self.primary_agent.reset(worlds=index, testing=testing)
+
+            # Reset metrics for this trial
+            self.trial_data['testing'][index] = testing
+            self.trial_data['initial_distance'][index] = distance
+            self.trial_data['initial_deadline'][index] = deadline
+            self.trial_data['final_deadline'][index] = deadline
+            self.trial_data['net_reward'][index] = 0.0
+            self.trial_data['actions'][index] = 0
+            self.trial_data['parameters']['e'][index] = self.primary_agent.epsilon[index]
+            self.trial_data['parameters']['a'][index] = self.primary_agent.alpha[index]
+            self.trial_data['success'][index] = 0
+
+    def step(self):
+        """ Takes a time step in every world whose trial is still running. """
+
+        active = ~self.done
+
+        if self.verbose: # Debugging
+            print "VectorEnvironment.step(): {} worlds running".format(active.sum())
+
+        # Update agents, primary first
+        if self.primary_agent is not None:
+            self.primary_agent.update()
+
+        self.update_dummies(active)
+
+        # Update traffic lights
+        t = self.t[:, np.newaxis]
+        flip = active[:, np.newaxis] & (t - self.light_updated >= self.light_period)
+        self.light_state ^= flip
+        self.light_updated = np.where(flip, t, self.light_updated)
+        self._slot_inputs = None
+
+        if self.primary_agent is not None:
+            # Agent has taken an action: reduce the deadline by 1
+            self.deadline[active] -= 1
+            expired = active & (self.deadline <= self.hard_time_limit)
+            if self.enforce_deadline:
+                expired |= active & (self.deadline <= 0)
+            self.done[expired] = True
+            self.success[expired] = False
+
+        self.t[active] += 1
+
+    def sense(self):
+        """ Returns the sensor inputs of the primary agent in every world.
+            'light' is True for green, the traffic inputs are action codes. """
+
+        return self.sense_agents(np.arange(self.num_worlds), self.location, self.heading)
+
+    def sense_agents(self, worlds, location, heading):
+        """ Returns the sensor inputs of agents in 'worlds' at 'location' with 'heading'.
+            Only dummy agents are seen, as Environment.sense ignores the primary agent. """
+
+        if self._slot_inputs is None:
+            self._slot_inputs = self.slot_inputs()
+        oncoming, right, left = self._slot_inputs
+
+        intersection = self.intersection_index(location)
+        vertical = heading % 2 == 1
+        light = self.light_state[worlds, intersection] == vertical
+
+        base = (worlds * self.num_intersections + intersection) * len(self.valid_headings)
+        return {
+            'light': light,
+            'oncoming': oncoming[base + (heading + 2) % 4],
+            'left': left[base + (heading + 3) % 4],
+            'right': right[base + (heading + 1) % 4]
+        }
+
+    def slot_inputs(self):
+        """ Computes, for every (world, intersection, heading) slot, the input an agent
+            perceives from the dummies in that slot as oncoming, right and left traffic.
+            Dummies are visited in index order, following the override precedence of
+            Environment.sense. """
+
+        num_slots = self.num_worlds * self.num_intersections * len(self.valid_headings)
+        intersection = self.intersection_index(self.dummy_location.reshape(-1, 2))
+        slots = (self._dummy_world * self.num_intersections + intersection) * len(self.valid_headings) + self.dummy_heading.ravel()
+        waypoint = self.dummy_waypoint.ravel()
+        dummies = np.arange(len(waypoint))
+
+        # Last dummy in each slot, and first dummy in each slot going forward or left
+        # (with repeated indices the last assignment wins, dummies are in index order)
+        last = np.full(num_slots, -1, dtype=int)
+        last[slots] = dummies
+        first = np.full(num_slots, -1, dtype=int)
+        turning = np.flatnonzero((waypoint == FORWARD) | (waypoint == LEFT))[::-1]
+        first[slots[turning]] = turning
+
+        waypoints = np.append(waypoint, NONE)  # index -1 (empty slot) picks the padded None
+        last_waypoint = waypoints[last]
+
+        any_left = np.zeros(num_slots, dtype=bool)
+        any_left[slots[waypoint == LEFT]] = True
+        any_forward = np.zeros(num_slots, dtype=bool)
+        any_forward[slots[waypoint == FORWARD]] = True
+
+        oncoming = np.where(any_left, LEFT, last_waypoint)  # oncoming == 'left' is never overridden
+        right = np.where(first >= 0, waypoints[first], last_waypoint)  # nor right == 'forward' or 'left'
+        left = np.where(any_forward, FORWARD, last_waypoint)  # nor left == 'forward'
+        return oncoming, right, left
+
+    def get_deadline(self):
+        """ Returns the deadline remaining for the primary agent in every world. """
+
+        return self.deadline
+
+    def get_next_waypoint(self):
+        """ Returns the next waypoint of the primary agent in every world, see WaypointTable. """
+
+        return self.waypoint_table.lookup_batch(self.location, self.heading, self.destination)
+
+    def act(self, actions):
+        """ Performs the primary agents' 'actions' where legal and returns their rewards,
+            following the traffic laws and reward scheme of Environment.act.
+            Worlds whose trial is done are left untouched and receive no reward. """
+
+        actions = np.asarray(actions)
+        active = ~self.done
+        inputs = self.sense()
+        green = inputs['light']
+        oncoming = inputs['oncoming']
+        waypoint = self.get_next_waypoint()
+
+        # Assess whether the agent can move based on the action chosen.
+        # 0: Action okay, 1: Minor violation, 2: Major violation,
+        # 3: Minor violation causing an accident, 4: Major violation causing an accident
+        violation = np.zeros(self.num_worlds, dtype=int)
+        cross_traffic = (inputs['left'] == FORWARD) | (inputs['right'] == FORWARD)
+
+        forward = actions == FORWARD
+        violation[forward & ~green] = 2
+        violation[forward & ~green & cross_traffic] = 4
+
+        left = actions == LEFT
+        violation[left & ~green] = 2
+        violation[left & ~green & (cross_traffic | (oncoming == RIGHT))] = 4
+        violation[left & green & ((oncoming == RIGHT) | (oncoming == FORWARD))] = 3
+
+        right = actions == RIGHT
+        violation[right & ~green & (inputs['left'] == FORWARD)] = 3
+
+        idle = actions == NONE
+        violation[idle & green] = 1
+
+        # Reward scheme: uniform noise from [-1, 1], scaled by the deadline penalty
+        reward = 2 * self.random.rand(self.num_worlds) - 1
+        penalty = 0.0
+        if self.enforce_deadline:
+            gradient = 10
+            fnc = self.t * 1.0 / (self.t + self.deadline)
+            penalty = (np.power(gradient, fnc) - 1) / (gradient - 1)
+
+        legal = violation == 0
+        bonus = np.where(actions == waypoint, 2,  # Correct action
+                np.where(idle & ~green & (waypoint == RIGHT), 1,  # Idling when we should have gone right on red
+                np.where(idle & ~green, 2, 1))) - penalty  # Stuck at a red light, or valid but incorrect
+        reward += np.where(legal, bonus, VIOLATION_REWARDS[violation])
+
+        # Move the agents
+        move = active & legal & ~idle
+        heading = self.heading
+        heading = np.where(move & left, (heading + 1) % 4, heading)
+        heading = np.where(move & right, (heading + 3) % 4, heading)
+        self.heading = heading
+        self.location[move] = self.wrap(self.location[move] + HEADINGS[heading[move]])
+
+        # Did agents reach the goal after a valid move?
+        arrived = active & (self.location == self.destination).all(axis=1)
+        self.trial_data['success'][arrived & (self.deadline >= 0)] = 1
+        self.done[arrived] = True
+        self.success[arrived] = True
+
+        # Update metrics
+        self.trial_data['final_deadline'][active] = self.deadline[active] - 1
+        self.trial_data['net_reward'][active] += reward[active]
+        self.trial_data['actions'][active, violation[active]] += 1
+
+        reward[~active] = 0.0
+        return reward
+
+    def update_dummies(self, worlds):
+        """ Moves the dummy agents in 'worlds' (a boolean mask) randomly under legal
+            traffic laws, see DummyAgent. """
+
+        location = self.dummy_location.reshape(-1, 2)
+        heading = self.dummy_heading.ravel()
+        waypoint = self.dummy_waypoint.ravel()
+        inputs = self.sense_agents(self._dummy_world, location, heading)
+
+        # Check if the chosen waypoint is safe to move to
+        red = ~inputs['light']
+        okay = np.repeat(worlds, self.num_dummies)
+        okay[(waypoint == RIGHT) & red & (inputs['left'] == FORWARD)] = False
+        okay[(waypoint == FORWARD) & red] = False
+        okay[(waypoint == LEFT) & (red | (inputs['oncoming'] == FORWARD) | (inputs['oncoming'] == RIGHT))] = False
+
+        # Move to the next waypoint and choose a new one
+        heading[okay & (waypoint == LEFT)] += 1
+        heading[okay & (waypoint == RIGHT)] += 3
+        heading %= 4
+        location[okay] = self.wrap(location[okay] + HEADINGS[heading[okay]])
+        waypoint[okay] = self.random.randint(FORWARD, RIGHT + 1, size=okay.sum())
+        self._slot_inputs = None
+
+    def random_locations(self, n):
+        """ Returns 'n' uniformly random intersections. """
+
+        return np.column_stack((self.random.randint(self.grid_size[0], size=n),
+                                self.random.randint(self.grid_size[1], size=n)))
+
+    def intersection_index(self, location):
+        """ Flat index of the intersection at each location. """
+
+        return location[..., 0] * self.grid_size[1] + location[..., 1]
+
+    def intersection_location(self, index):
+        """ Location of each flat intersection index. """
+
+        return np.stack((index // self.grid_size[1], index % self.grid_size[1]), axis=-1)
+
+    def wrap(self, location):
+        """ Wraps locations around the edges of the world. """
+
+        return location % self.grid_size
+
+    def compute_dist(self, a, b):
+        """ Compute the Manhattan (L1) distance of a spherical world, element-wise. """
+
+        d = np.abs(b - a)
+        return np.minimum(d, np.abs(self.grid_size - d)).sum(axis=-1)
+
+    def _world_index(self, worlds):
+        """ Converts a boolean mask or index array (default all worlds) to indices. """
+
+        if worlds is None:
+            return np.arange(self.num_worlds)
+        worlds = np.asarray(worlds)
+        if worlds.dtype == bool:
+            return np.flatnonzero(worlds)
+        return worlds
+
+
+class VectorLearningAgent(object):
+    """ The LearningAgent of every world of a VectorEnvironment.
+
+        Hyper-parameters may differ per world. The Q-tables of all worlds are one
+        (worlds, states, actions) array indexed by integer states encoding the
+        (light, waypoint, left, oncoming[, right]) tuple of LearningAgent. """
+
+    def __init__(self, env, learning=False, epsilon=1.0, alpha=0.5, seed=None, decay_function=0, epsilon_step=0.05, use_input_right=True):
+        self.env = env
+        self.valid_actions = self.env.valid_actions
+        self.random = env.random_stream('agent') if seed is None else np.random.RandomState(derive_seed(seed, 'agent') % 2**32)
+
+        # Set parameters of the learning agents, one per world
+        shape = (env.num_worlds,)
+        self.learning = learning
+        self.epsilon = np.array(np.broadcast_to(epsilon, shape), dtype=float)
+        self.alpha = np.array(np.broadcast_to(alpha, shape), dtype=float)
+        self.decay_function = np.array(np.broadcast_to(decay_function, shape), dtype=int)
+        self.epsilon_step = np.array(np.broadcast_to(epsilon_step, shape), dtype=float)
+        self.use_input_right = use_input_right
+        self.t = np.zeros(shape)
+
+        num_inputs = 4 if use_input_right else 3
+        self.num_states = 2 * len(self.valid_actions) ** num_inputs
+        self.Q = np.zeros((env.num_worlds, self.num_states, len(self.valid_actions)))
+        self.state = None
+
+    def reset(self, worlds, testing=False):
+        """ Called at the beginning of each trial in 'worlds'. """
+
+        self.t[worlds] += 1.0
+        t = self.t[worlds]
+        epsilon = self.epsilon[worlds]
+        alpha = self.alpha[worlds]
+        decay = self.decay_function[worlds]
+
+        # Update epsilon using each world's decay function (see LearningAgent.reset)
+        self.epsilon[worlds] = np.select(
+            [decay == 0, decay == 1, decay == 2, decay == 3, decay == 4, decay == 5],
+            [epsilon - self.epsilon_step[worlds],
+             np.power(alpha, t),
+             1.0 / np.power(t, 2),
+             np.exp(alpha * t * (-1.0)),
+             np.cos(alpha * t),
+             np.exp(np.sqrt(t) * (-0.05))],
+            0.0)
+
+        # If 'testing' is True, set epsilon and alpha to 0
+        testing = np.broadcast_to(testing, t.shape)
+        self.epsilon[worlds[testing]] = 0.0
+        self.alpha[worlds[testing]] = 0.0
+
+    def build_state(self):
+        """ Encodes the state of the primary agent in every world as an integer. """
+
+        waypoint = self.env.get_next_waypoint()
+        inputs = self.env.sense()
+
+        state = inputs['light'].astype(int)
+        for code in (waypoint, inputs['left'], inputs['oncoming']):
+            state = state * len(self.valid_actions) + code
+        if self.use_input_right:
+            state = state * len(self.valid_actions) + inputs['right']
+        return state
+
+    def choose_action(self, state):
+        """ Chooses an action per world: random with 'epsilon' probability when
+            learning, otherwise the highest Q-value with random tie-breaking. """
+
+        self.state = state
+        num_worlds = len(state)
+        explore = self.random.randint(len(self.valid_actions), size=num_worlds)
+        if not self.learning:
+            return explore
+
+        Q = self.Q[np.arange(num_worlds), state]
+        ties = Q == Q.max(axis=1)[:, np.newaxis]
+        greedy = np.argmax(ties * self.random.rand(*Q.shape), axis=1)
+        return np.where(self.random.uniform(0.0, 1.0, size=num_worlds) <= self.epsilon, explore, greedy)
+
+    def learn(self, worlds, state, action, reward):
+        """ Q-learning update with learning rate 'alpha' for 'worlds' (no discount factor). """
+
+        if self.learning:
+            alpha = self.alpha[worlds]
+            self.Q[worlds, state, action] = self.Q[worlds, state, action] * (1.0 - alpha) + reward * alpha
+
+    def update(self):
+        """ Builds the states, chooses the actions, receives the rewards and learns,
+            for every world whose trial is still running. """
+
+        worlds = np.flatnonzero(~self.env.done)
+        state = self.build_state()
+        action = self.choose_action(state)
+        reward = self.env.act(action)
+        self.learn(worlds, state[worlds], action[worlds], reward[worlds])
+
+
+class VectorSimulator(object):
+    """ Runs the trials of every world of a VectorEnvironment in lockstep,
+        with the training and testing bookkeeping of Simulator.run. """
+
+    log_fields = ['world', 'trial', 'testing', 'parameters', 'initial_deadline', 'final_deadline', 'net_reward', 'actions', 'success']
+
+    def __init__(self, env, log_metrics=False, log_filename=None):
+        self.env = env
+        self.log_metrics = log_metrics
+        self.log_filename = log_filename if log_filename is not None else os.path.join("logs", "sim_vector-learning.csv")
+        self.trials = []
+        self.episodes_per_second = None
+
+    def run(self, tolerance=0.05, n_test=0):
+        """ Run the simulation of all worlds.
+
+        'tolerance' is the minimum epsilon necessary to begin testing (if enabled)
+        'n_test' is the number of testing trials simulated per world
+
+        Note that the minimum number of training trials is always 20.
+        Returns the number of trials simulated per second. """
+
+        env = self.env
+        a = env.primary_agent
+        num_worlds = env.num_worlds
+
+        total_trials = np.ones(num_worlds, dtype=int)
+        testing = np.zeros(num_worlds, dtype=bool)
+        trial = np.ones(num_worlds, dtype=int)
+        finished = np.zeros(num_worlds, dtype=bool)
+        begin = np.ones(num_worlds, dtype=bool)
+        self.trials = []
+        start = time.time()
+
+        while True:
+            # Flip testing switch, must complete minimum 20 training trials
+            flip = begin & ~testing & (total_trials > 20)
+            if a.learning:
+                flip &= a.epsilon < tolerance # assumes epsilon decays to 0
+            testing[flip] = True
+            trial[flip] = 1
+
+            # Stop worlds that reached the limit of testing trials
+            finished |= begin & testing & (trial > n_test)
+            begin &= ~finished
+            if finished.all():
+                break
+
+            if begin.any():
+                env.reset(testing, worlds=begin)
+
+            env.step()
+
+            # Collect metrics from finished trials
+            ended = env.done & ~finished
+            for world in np.flatnonzero(ended):
+                self.trials.append({
+                    'world': int(world),
+                    'trial': int(trial[world]),
+                    'testing': bool(testing[world]),
+                    'parameters': {'e': float(env.trial_data['parameters']['e'][world]), 'a': float(env.trial_data['parameters']['a'][world])},
+                    'initial_deadline': int(env.trial_data['initial_deadline'][world]),
+                    'final_deadline': int(env.trial_data['final_deadline'][world]),
+                    'net_reward': float(env.trial_data['net_reward'][world]),
+                    'actions': dict(enumerate(env.trial_data['actions'][world].tolist())),
+                    'success': int(env.trial_data['success'][world])
+                })
+
+            total_trials[ended] += 1
+            trial[ended] += 1
+            begin = ended
+
+        elapsed = time.time() - start
+        self.episodes_per_second = len(self.trials) / elapsed if elapsed > 0 else float('inf')
+
+        if self.log_metrics:
+            with open(self.log_filename, 'wb') as log_file:
+                log_writer = csv.DictWriter(log_file, fieldnames=self.log_fields)
+                log_writer.writeheader()
+                log_writer.writerows(self.trials)
+
+        print "{} trials simulated in {} worlds in {:.2f} seconds ({:.2f} trials/second).".format(len(self.trials), num_worlds, elapsed, self.episodes_per_second)
+        return self.episodes_per_second
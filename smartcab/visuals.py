@@ -6,34 +6,71 @@ warnings.filterwarnings("ignore", category = UserWarning, module = "matplotlib")
 ###########################################
 #
 # Display inline matplotlib plots with IPython
-from IPython import get_ipython
-get_ipython().run_line_magic('matplotlib', 'inline')
+# (outside of IPython, e.g. when rating logs from a script, there is nothing to set up)
+try:
+    from IPython import get_ipython
+except ImportError:
+    get_ipython = lambda: None
+if get_ipython() is not None:
+    get_ipython().run_line_magic('matplotlib', 'inline')
 ###########################################
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import os
-import ast
+import sys
+
+# Numeric columns for the count of each violation class (see Environment.act)
+violation_columns = ['good_actions', 'minor_violations', 'major_violations', 'minor_accidents', 'major_accidents']
+
+
+def parse_trials(data):
+	""" Parses the stringified 'actions' and 'parameters' dicts of a Simulator log
+	    once into the numeric violation columns, 'epsilon' and 'alpha'. """
+
+	data = data.copy()
+	for violation, column in enumerate(violation_columns):
+		data[column] = data['actions'].str.extract(r'[{{ ]{}: (\d+)'.format(violation), expand=False).astype(int)
+	data['epsilon'] = data['parameters'].str.extract(r"'e': ([^,}]+)", expand=False).astype(float)
+	data['alpha'] = data['parameters'].str.extract(r"'a': ([^,}]+)", expand=False).astype(float)
+	return data
+
+
+def load_trials(path):
+	""" Loads a trial log with numeric columns, from the default Simulator log
+	    or from the typed '.csv' or '.npz' logs of a MetricsLog. """
+
+	if path.endswith('.npz'):
+		archive = np.load(path)
+		return pd.DataFrame(dict((name, archive[name]) for name in archive.files))
+
+	data = pd.read_csv(path)
+	if 'actions' in data:
+		data = parse_trials(data)
+	return data
 
 
 def calculate_safety(data):
 	""" Calculates the safety rating of the smartcab during testing. """
 
+	if 'major_accidents' not in data:
+		data = parse_trials(data)
+
 	good_ratio = data['good_actions'].sum() * 1.0 / \
 	(data['initial_deadline'] - data['final_deadline']).sum()
 
 	if good_ratio == 1: # Perfect driving
 		return ("A+", "green")
 	else: # Imperfect driving
-		if data['actions'].apply(lambda x: ast.literal_eval(x)[4]).sum() > 0: # Major accident
+		if data['major_accidents'].sum() > 0: # Major accident
 			return ("F", "red")
-		elif data['actions'].apply(lambda x: ast.literal_eval(x)[3]).sum() > 0: # Minor accident
+		elif data['minor_accidents'].sum() > 0: # Minor accident
 			return ("D", "#EEC700")
-		elif data['actions'].apply(lambda x: ast.literal_eval(x)[2]).sum() > 0: # Major violation
+		elif data['major_violations'].sum() > 0: # Major violation
 			return ("C", "#EEC700")
 		else: # Minor violation
-			minor = data['actions'].apply(lambda x: ast.literal_eval(x)[1]).sum()
+			minor = data['minor_violations'].sum()
 			if minor >= len(data)/2: # Minor violation in at least half of the trials
 				return ("B", "green")
 			else:
@@ -63,29 +100,21 @@ def calculate_reliability(data):
 def plot_trials(csv):
 	""" Plots the data from logged metrics during a simulation."""
 
-	data = pd.read_csv(os.path.join("logs", csv))
+	data = load_trials(os.path.join("logs", csv))
 
 	if len(data) < 10:
 		print "Not enough data collected to create a visualization."
 		print "At least 20 trials are required."
 		return
 	
-	# Create additional features
-	data['average_reward'] = (data['net_reward'] / (data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
+	# Create additional features: 10-trial rolling averages of the reward and
+	# reliability, and of the relative frequency of each violation class
+	steps = data['initial_deadline'] - data['final_deadline']
+	data['average_reward'] = (data['net_reward'] / steps).rolling(window=10, center=False).mean()
 	data['reliability_rate'] = (data['success']*100).rolling(window=10, center=False).mean()  # compute avg. net reward with window=10
-	data['good_actions'] = data['actions'].apply(lambda x: ast.literal_eval(x)[0])
-	data['good'] = (data['good_actions'] * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['minor'] = (data['actions'].apply(lambda x: ast.literal_eval(x)[1]) * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['major'] = (data['actions'].apply(lambda x: ast.literal_eval(x)[2]) * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['minor_acc'] = (data['actions'].apply(lambda x: ast.literal_eval(x)[3]) * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['major_acc'] = (data['actions'].apply(lambda x: ast.literal_eval(x)[4]) * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['epsilon'] = data['parameters'].apply(lambda x: ast.literal_eval(x)['e']) 
-	data['alpha'] = data['parameters'].apply(lambda x: ast.literal_eval(x)['a']) 
+	rates = data[violation_columns].div(steps, axis=0).rolling(window=10, center=False).mean()
+	rates.columns = ['good', 'minor', 'major', 'minor_acc', 'major_acc']
+	data = data.join(rates)
 
 
 	# Create training and testing subsets
@@ -119,7 +148,7 @@ def plot_trials(csv):
 	ax = plt.subplot2grid((6,6), (2,3), colspan=3, rowspan=2)
 
 	# Check whether the agent was expected to learn
-	if csv != 'sim_no-learning.csv':
+	if os.path.splitext(csv)[0] != 'sim_no-learning':
 		ax.set_ylabel("Parameter Value")
 		ax.set_xlabel("Trial Number")
 		ax.set_xlim((1, len(training_data)))
@@ -205,3 +234,30 @@ def plot_trials(csv):
 
 	plt.tight_layout()
 	plt.show()
+
+
+def rate_trials(path):
+	""" Returns the number of training and testing trials in a log and the safety
+	    and reliability ratings of its testing trials, without plotting. """
+
+	data = load_trials(path)
+	training_data = data[data['testing'] == False]
+	testing_data = data[data['testing'] == True]
+
+	result = {'training_trials': len(training_data), 'testing_trials': len(testing_data), 'safety': None, 'reliability': None}
+	if len(testing_data) > 0:
+		result['safety'] = calculate_safety(testing_data)[0]
+		result['reliability'] = calculate_reliability(testing_data)[0]
+	return result
+
+
+def main(paths):
+	""" Rates a batch of trial logs outside of IPython, e.g.
+	    'python visuals.py logs/sim_sweep-*.csv'. """
+
+	results = pd.DataFrame([rate_trials(path) for path in paths], index=paths)
+	print results[['safety', 'reliability', 'training_trials', 'testing_trials']].to_string()
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])